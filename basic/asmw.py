@@ -17,6 +17,16 @@ class RegMixin(object):
     @property
     def ebp(self):
         return self.reg('ebp')
+    @property
+    def esi(self):
+        return self.reg('esi')
+    @property
+    def edi(self):
+        return self.reg('edi')
+
+    # registers the register allocator may use for variables. they are
+    # preserved by called library functions, eax, ecx and edx are scratch.
+    allocatable = ('ebx', 'esi', 'edi')
     
     
 class GASM(RegMixin):
@@ -72,19 +82,34 @@ class GASM(RegMixin):
         self.emit('call %s' % name)
         
     def mov(self, dst, src):
-        self.emit('mov %s, %s' % (src, dst))
+        self.emit('movl %s, %s' % (src, dst))
         
+    def add(self, dst, src):
+        self.emit('addl %s, %s' % (src, dst))
+
     def sub(self, dst, src):
-        self.emit('sub %s, %s' % (src, dst))
+        self.emit('subl %s, %s' % (src, dst))
+
+    def imul(self, dst, src):
+        self.emit('imull %s, %s' % (src, dst))
+
+    def cdq(self):
+        self.emit('cdq')
+
+    def idiv(self, src):
+        self.emit('idivl %s' % src)
         
     def cmp(self, dst, src):
-        self.emit('sub %s, %s' % (src, dst))
+        self.emit('cmpl %s, %s' % (src, dst))
+
+    def test(self, dst, src):
+        self.emit('testl %s, %s' % (src, dst))
 
     def push(self, src):
-        self.emit('push %s' % src)
+        self.emit('pushl %s' % src)
         
     def pop(self, dst):
-        self.emit('pop %s' % dst)
+        self.emit('popl %s' % dst)
         
     def sete(self, dst):
         self.emit('sete %s' % dst)
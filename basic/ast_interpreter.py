@@ -1,12 +1,16 @@
 import sys
-from operator import add, sub, mul, div, eq
+from operator import add, sub, mul, eq
 import parser
+import tac
+import astopt
+import lineprofile
+import basicio
 
 operations = {
     'add_int': add,
     'sub_int': sub,
     'mul_int': mul,
-    'div_int': div,
+    'div_int': tac.div_int,
     'eq_int': lambda x,y: int(eq(x,y)),
     'eq_str': lambda x,y: int(eq(x,y)),
     'cat_str': add}
@@ -44,7 +48,9 @@ class ASTInterpreter:
         else:
             assert False, expr
 
-    def execute(self):
+    def execute(self, profile=None):
+        if profile is not None:
+            return self.execute_profiled(profile)
         ip = 0
         while True:
             instr = self.code[ip]
@@ -55,6 +61,21 @@ class ASTInterpreter:
             elif jump is not None:
                 ip = self.labels[jump]
 
+    def execute_profiled(self, profile):
+        '''execute telling profile, a lineprofile.LineProfile, about every line'''
+        lines = lineprofile.code_lines(self.labels)
+        ip = 0
+        while True:
+            profile.enter(lines[ip])
+            instr = self.code[ip]
+            ip += 1
+            jump = self.exec_one_instr(instr)
+            if jump is 'end':
+                break
+            elif jump is not None:
+                ip = self.labels[jump]
+        profile.stop()
+
     def exec_one_instr(self, instr):
         if instr[0] == 'input':
             prompt = self.evaluate(instr[1])
@@ -82,10 +103,129 @@ class ASTInterpreter:
         else:
             assert False, instr
             
-def main(fname):
+
+class ClosureInterpreter:
+    '''compiles the AST code once into a flat list of closures.
+
+    each closure executes one statement and returns the index of the next
+    statement to execute, or None when the program ends. operands, constants
+    and jump targets are all resolved at compile time.'''
+    def __init__(self, ast_context, write=sys.stdout.write, read=sys.stdin.readline):
+        self.const_int = ast_context.const_int
+        self.const_str = ast_context.const_str
+        self.integers = [0] * ast_context.nb_int
+        self.strings = [''] * ast_context.nb_str
+        self.labels = ast_context.labels
+        self.read = read
+        self.write = write
+        self.code = [self.compile_instr(instr, ip+1) for ip, instr in enumerate(ast_context.code)]
+
+    def variables(self, typ):
+        return {'int': self.integers, 'str': self.strings}[typ]
+
+    def constant(self, typ, index):
+        return {'int': self.const_int, 'str': self.const_str}[typ][index]
+
+    def compile_expr(self, expr):
+        if expr[0] in operations:
+            op = operations[expr[0]]
+            a, b = expr[2], expr[3]
+            # specialise the common operand shapes to save a call per operand
+            if a[0] == 'var' and b[0] == 'cst':
+                va, ia = self.variables(a[1]), a[2]
+                cb = self.constant(b[1], b[2])
+                return lambda: op(va[ia], cb)
+            elif a[0] == 'var' and b[0] == 'var':
+                va, ia = self.variables(a[1]), a[2]
+                vb, ib = self.variables(b[1]), b[2]
+                return lambda: op(va[ia], vb[ib])
+            fa = self.compile_expr(a)
+            fb = self.compile_expr(b)
+            return lambda: op(fa(), fb())
+        elif expr[0] == 'var':
+            variables, index = self.variables(expr[1]), expr[2]
+            return lambda: variables[index]
+        elif expr[0] == 'cst':
+            value = self.constant(expr[1], expr[2])
+            return lambda: value
+        else:
+            assert False, expr
+
+    def compile_instr(self, instr, next_ip):
+        if instr[0] == 'input':
+            prompt = self.compile_expr(instr[1])
+            variables, index = self.variables(instr[2]), instr[3]
+            convert = int if instr[2] == 'int' else str
+            write = self.write
+            read = self.read
+            def input_():
+                write(prompt())
+                variables[index] = convert(read().rstrip('\n'))
+                return next_ip
+            return input_
+        elif instr[0] == 'assign':
+            variables, index = self.variables(instr[1]), instr[2]
+            value = self.compile_expr(instr[3])
+            def assign():
+                variables[index] = value()
+                return next_ip
+            return assign
+        elif instr[0] == 'if':
+            cond = self.compile_expr(instr[1])
+            then = self.compile_instr(instr[2], next_ip)
+            def if_():
+                if cond():
+                    return then()
+                return next_ip
+            return if_
+        elif instr[0] == 'goto':
+            target = self.labels[instr[1]]
+            return lambda: target
+        elif instr[0] == 'print':
+            exprs = [self.compile_expr(ex) for ex in instr[1:]]
+            write = self.write
+            def print_():
+                write(''.join([str(ex()) for ex in exprs])+'\n')
+                return next_ip
+            return print_
+        elif instr[0] == 'end':
+            return lambda: None
+        else:
+            assert False, instr
+
+    def execute(self):
+        code = self.code
+        ip = 0
+        while ip is not None:
+            ip = code[ip]()
+
+
+def main(fname, interpreter=ClosureInterpreter):
+    with open(fname, 'r') as infile:
+        ast_ctx = parser.parse(infile)
+    astopt.optimize(ast_ctx)
+    output, reader = basicio.standard_io()
+    try:
+        interpreter(ast_ctx, output.write, reader.readline).execute()
+    finally:
+        output.close()
+
+def profile(fname):
     with open(fname, 'r') as infile:
         ast_ctx = parser.parse(infile)
-    ASTInterpreter(ast_ctx).execute()
+    astopt.optimize(ast_ctx)
+    line_profile = lineprofile.LineProfile()
+    output, reader = basicio.standard_io()
+    try:
+        ASTInterpreter(ast_ctx, output.write, reader.readline).execute(line_profile)
+    finally:
+        output.close()
+    line_profile.report()
     
 if __name__ == '__main__':
-    main(sys.argv[1])
\ No newline at end of file
+    if sys.argv[1] == '--walk':
+        main(sys.argv[2], ASTInterpreter)
+    elif sys.argv[1] == '--profile':
+        profile(sys.argv[2])
+    else:
+        main(sys.argv[1])
\ No newline at end of file
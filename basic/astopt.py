@@ -0,0 +1,153 @@
+'''optimization of the AST code of a BASIC program, shared by all backends.
+
+optimize(ast_context) rewrites ast_context.code and ast_context.labels in
+place: constant expressions are folded, additions of 0, multiplications and
+divisions by 1 and concatenations with "" are simplified, IF statements
+with a constant condition are resolved, GOTOs to a GOTO jump to the final
+target and statements that can not be reached are removed.
+
+a line keeps its label as long as its statement is kept or it is the
+target of a jump, the label of a line whose statement is removed goes to
+the next statement that is kept.'''
+
+import tac
+
+class Optimizer:
+    def __init__(self, ast_context):
+        self.context = ast_context
+
+    def const_value(self, expr):
+        return {'int': self.context.const_int,
+                'str': self.context.const_str}[expr[1]][expr[2]]
+
+    def const(self, typ, value):
+        return ('cst', typ, self.context.add_const(typ, value))
+
+    def has_value(self, expr, value):
+        return expr[0] == 'cst' and self.const_value(expr) == value
+
+    def fold(self, expr):
+        if expr[0] not in tac.operations:
+            return expr
+        op, typ = expr[0], expr[1]
+        a = self.fold(expr[2])
+        b = self.fold(expr[3])
+        if a[0] == 'cst' and b[0] == 'cst':
+            x, y = self.const_value(a), self.const_value(b)
+            # a division by zero is left to run time, the line may never run
+            if op != 'div_int' or y != 0:
+                return self.const(typ, tac.fold[op](x, y))
+        if op == 'add_int' and self.has_value(a, 0):
+            return b
+        if op in ('add_int', 'sub_int') and self.has_value(b, 0):
+            return a
+        if op == 'mul_int' and self.has_value(a, 1):
+            return b
+        if op in ('mul_int', 'div_int') and self.has_value(b, 1):
+            return a
+        if op == 'cat_str' and self.has_value(a, ''):
+            return b
+        if op == 'cat_str' and self.has_value(b, ''):
+            return a
+        return (op, typ, a, b)
+
+    def statement(self, stmt):
+        '''the statement with its expressions folded, None if it does nothing'''
+        if stmt[0] == 'input':
+            return ('input', self.fold(stmt[1])) + stmt[2:]
+        elif stmt[0] == 'assign':
+            return stmt[:3] + (self.fold(stmt[3]),)
+        elif stmt[0] == 'if':
+            cond = self.fold(stmt[1])
+            then = self.statement(stmt[2])
+            if cond[0] == 'cst':
+                return then if self.const_value(cond) else None
+            if then is None:
+                return None
+            return ('if', cond, then)
+        elif stmt[0] == 'print':
+            return ('print',) + tuple(self.fold(expr) for expr in stmt[1:])
+        return stmt
+
+    def target(self, code, lineno):
+        '''the line a jump to lineno ends up at, following chains of GOTOs'''
+        seen = set()
+        while lineno not in seen:
+            seen.add(lineno)
+            index = self.context.labels[lineno]
+            while index < len(code) and code[index] is None:
+                index += 1
+            if index == len(code) or code[index][0] != 'goto':
+                break
+            lineno = code[index][1]
+        return lineno
+
+    def thread(self, code, stmt):
+        if stmt[0] == 'goto':
+            return ('goto', self.target(code, stmt[1]))
+        elif stmt[0] == 'if':
+            return ('if', stmt[1], self.thread(code, stmt[2]))
+        return stmt
+
+    def reachable(self, code):
+        '''the indices of the statements that can be executed'''
+        def successors(stmt, index):
+            if stmt[0] == 'goto':
+                return [self.context.labels[stmt[1]]]
+            elif stmt[0] == 'end':
+                return []
+            elif stmt[0] == 'if':
+                return successors(stmt[2], index) + [index + 1]
+            return [index + 1]
+
+        seen = set()
+        todo = [0]
+        while todo:
+            index = todo.pop()
+            while index < len(code) and code[index] is None:
+                index += 1
+            if index in seen or index >= len(code):
+                continue
+            seen.add(index)
+            todo.extend(successors(code[index], index))
+        return seen
+
+    def optimize(self):
+        '''returns the number of statements removed'''
+        context = self.context
+        old_code = context.code
+        code = [self.statement(stmt) for stmt in old_code]
+        code = [None if stmt is None else self.thread(code, stmt) for stmt in code]
+        live = self.reachable(code)
+
+        targets = set()
+        def jumps(stmt):
+            if stmt[0] == 'goto':
+                targets.add(stmt[1])
+            elif stmt[0] == 'if':
+                jumps(stmt[2])
+        new_code = []
+        new_index = []
+        for index, stmt in enumerate(code):
+            new_index.append(len(new_code))
+            if index in live:
+                new_code.append(stmt)
+                jumps(stmt)
+        new_index.append(len(new_code))
+
+        # the statement at an index belongs to the last line with that index
+        owner = {}
+        for lineno, index in sorted(context.labels.items()):
+            owner[index] = lineno
+        labels = {}
+        for lineno, index in context.labels.items():
+            if lineno in targets or (owner[index] == lineno and index in live):
+                labels[lineno] = new_index[index]
+        context.code = new_code
+        context.labels = labels
+        return len(old_code) - len(new_code)
+
+def optimize(ast_context):
+    '''optimize the code of ast_context in place, returns the number of
+    statements removed'''
+    return Optimizer(ast_context).optimize()
@@ -1,18 +1,25 @@
+import sys
 import parser
+import astopt
 import subprocess
 import asmw
 import tac
 import bytecode
+import basicio
 
 if __name__ == '__main__':
     with open('test.bas', 'r') as infile:
         ast_ctx = parser.parse(infile)
-        
+    sys.stderr.write('AST optimizer removed %d statements\n' % astopt.optimize(ast_ctx))
+    
     
     tac_ctx = tac.TAC.fromast(ast_ctx)
+    sys.stderr.write('TAC optimizer removed %d instructions\n' % tac_ctx.optimize())
     
     #tac_ctx.dump()
-    tac_ctx.interpreter()
+    output, reader = basicio.standard_io()
+    tac_ctx.interpreter(write=output.write, read=reader.readline)
+    output.close()
     
     asm = asmw.GASM('test.s')
     tac_ctx.compile(asm)
@@ -21,7 +28,7 @@ if __name__ == '__main__':
     subprocess.call(['gcc', '-m32', 'test.s', 'lib.c', '-o', 'test'])
     subprocess.call(['test'], executable='./test')
     
-    bc_ctx = bytecode.BCContext.from_ast(ast_ctx)
+    bc_ctx = bytecode.BCContext.from_ast(ast_ctx).optimize()
     #interpreter = ASTInterpreter(ast_ctx)
     #interpreter.execute()
     
@@ -34,5 +41,6 @@ if __name__ == '__main__':
     with open('test.bac', 'rb') as infile:
         bc_ctx = bytecode.BCContext.from_file(infile)
     
-    bytecode.run_bytecode(bc_ctx)
+    bytecode.run_bytecode(bc_ctx, write=output.write, read=reader.readline)
+    output.close()
     
\ No newline at end of file
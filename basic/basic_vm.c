@@ -1,22 +1,69 @@
 #include <stdlib.h>
 #include <stdio.h>
+#include <string.h>
 #include "opcodes.h"
 #include "bc_string.h"
 
-typedef struct BCHead{
+/* version 1 files start directly with this header */
+typedef struct BCHeadV1{
 	unsigned short int code_length;
 	unsigned short int nb_int;
 	unsigned short int nb_str;
 	unsigned short int nb_const_int;
 	unsigned short int nb_const_str;
+} BCHeadV1;
+
+/* version 2 files start with "LBAC", version and flags, then this header */
+typedef struct BCHead{
+	unsigned int code_length;
+	unsigned int nb_int;
+	unsigned int nb_str;
+	unsigned int nb_const_int;
+	unsigned int nb_const_str;
 } BCHead;
 
-void disassemble(unsigned char* code, unsigned short int code_length)
+int read_head(FILE *f, BCHead *head)
+{
+	char magic[4];
+	if (fread(magic, 1, 4, f) != 4)
+		return 0;
+	if (memcmp(magic, "LBAC", 4) == 0){
+		unsigned short int version_flags[2];
+		if (fread(version_flags, sizeof(unsigned short int), 2, f) != 2 || version_flags[0] != 2)
+			return 0;
+		return fread(head, sizeof(*head), 1, f) == 1;
+	}
+	else{
+		BCHeadV1 v1;
+		memcpy(&v1, magic, 4);
+		if (fread((char*)&v1 + 4, sizeof(v1) - 4, 1, f) != 1)
+			return 0;
+		head->code_length = v1.code_length;
+		head->nb_int = v1.nb_int;
+		head->nb_str = v1.nb_str;
+		head->nb_const_int = v1.nb_const_int;
+		head->nb_const_str = v1.nb_const_str;
+		return 1;
+	}
+}
+
+void disassemble(unsigned char* code, unsigned int code_length)
 {
 	for (int i=0; i<code_length; i++){
 		if (code[i] >= sizeof(opnames) / sizeof(opnames[0]))
 			exit(EXIT_FAILURE);
-		if (code[i] > op_hasarg){
+		if (code[i] > op_hasarg2 && code[i] != op_ext){
+			unsigned short int arg = code[i+1] + 256*code[i+2];
+			unsigned short int arg2 = code[i+3] + 256*code[i+4];
+			if (i+4 < code_length){
+				printf("%3d: %s %hu %hu\n", i, opnames[code[i]], arg, arg2);
+			}
+			else {
+				exit(EXIT_FAILURE);
+			}
+			i += 4;
+		}
+		else if (code[i] > op_hasarg){
 			unsigned short int arg = code[i+1] + 256*code[i+2];
 			if (i+2 < code_length){
 				printf("%3d: %s %hu\n", i, opnames[code[i]], arg);
@@ -41,12 +88,20 @@ void execute(BCHead *head, int* const_int, BCString** const_str, unsigned char *
 	int *itos = istack;
 	BCString **stos = sstack;
 
+	unsigned int ext = 0;
+
 	for(;;){
 		unsigned char op = code[ip];
 		unsigned int arg = 0;
+		unsigned int arg2 = 0;
 		//puts(opnames[op]);
-		if (op>op_hasarg){
+		if (op>op_hasarg2 && op!=op_ext){
 			arg = code[ip+1] + 256*code[ip+2];
+			arg2 = code[ip+3] + 256*code[ip+4];
+			ip += 5;
+		}else if (op>op_hasarg){
+			arg = ext + code[ip+1] + 256*code[ip+2];
+			ext = 0;
 			ip += 3;
 		}else{
 			ip += 1;
@@ -57,6 +112,9 @@ void execute(BCHead *head, int* const_int, BCString** const_str, unsigned char *
 		switch(op){
 		case op_end:
 			goto cleanup;
+		case op_ext:
+			ext = arg << 16;
+			break;
 		case op_load_int:
 			*itos = integers[arg];
 			itos++;
@@ -158,6 +216,32 @@ void execute(BCHead *head, int* const_int, BCString** const_str, unsigned char *
 			if(*itos == 0)
 				ip = arg;
 			break;
+		case op_add_const_int:
+			*(itos-1) += const_int[arg];
+			break;
+		case op_sub_const_int:
+			*(itos-1) -= const_int[arg];
+			break;
+		case op_jne_int:
+			itos -= 2;
+			if(*itos != *(itos+1))
+				ip = arg;
+			break;
+		case op_print_const_str:
+			printf("%s ", const_str[arg]->data);
+			break;
+		case op_print_var_int:
+			printf("%d ", integers[arg]);
+			break;
+		case op_print_var_str:
+			printf("%s ", strings[arg]->data);
+			break;
+		case op_inc_int:
+			integers[arg] += const_int[arg2];
+			break;
+		case op_dec_int:
+			integers[arg] -= const_int[arg2];
+			break;
 		default:
 			fprintf(stderr, "\nError: unknown opcode %s.\n", opnames[op]);
 			exit(EXIT_FAILURE);
@@ -182,12 +266,15 @@ int main(int argc, char* argv[]){
 
 	FILE* f = fopen(argv[1], "rb");
 	struct BCHead head;
-	fread(&head, sizeof(head), 1, f);
-	printf("code_length = %hu\n", head.code_length);
-	printf("nb_int = %hu\n", head.nb_int);
-	printf("nb_str = %hu\n", head.nb_str);
-	printf("nb_const_int = %hu\n", head.nb_const_int);
-	printf("nb_const_str = %hu\n", head.nb_const_str);
+	if (!f || !read_head(f, &head)){
+		fputs("not a valid .bac file", stderr);
+		return EXIT_FAILURE;
+	}
+	printf("code_length = %u\n", head.code_length);
+	printf("nb_int = %u\n", head.nb_int);
+	printf("nb_str = %u\n", head.nb_str);
+	printf("nb_const_int = %u\n", head.nb_const_int);
+	printf("nb_const_str = %u\n", head.nb_const_str);
 
 	int *const_int = malloc(head.nb_const_int * sizeof(int));
 	fread(const_int, sizeof(int), head.nb_const_int, f);
@@ -0,0 +1,103 @@
+'''buffered input and output for the Python hosted executors.
+
+the executors print through a write function and read the lines for INPUT
+through a readline function, both given to them by the caller. Writer
+collects the output and writes it to a file according to its flush policy:
+
+    'line'  at the end of every line, for interactive use
+    'size'  whenever size pieces of output have been collected
+    'exit'  only when flush() or close() is called
+
+Reader takes the INPUT lines from a file or a list of lines. NullWriter
+drops all output, to benchmark an executor without the cost of printing.'''
+
+import sys
+
+POLICIES = ('line', 'size', 'exit')
+
+class Writer:
+    '''buffered output to the file out (sys.stdout by default).
+
+    write is chosen by the policy when the writer is made, with the 'exit'
+    policy it is the append of the buffer itself.'''
+    def __init__(self, out=None, policy='size', size=4096):
+        if policy not in POLICIES:
+            raise ValueError('unknown flush policy %r' % policy)
+        self.out = sys.stdout if out is None else out
+        self.policy = policy
+        self.size = size
+        self.buffer = []
+        self.write = self.make_write()
+
+    def make_write(self):
+        buffer = self.buffer
+        append = buffer.append
+        flush = self.flush
+        if self.policy == 'line':
+            def write(text):
+                append(text)
+                if '\n' in text:
+                    flush()
+        elif self.policy == 'size':
+            size = self.size
+            def write(text):
+                append(text)
+                if len(buffer) >= size:
+                    flush()
+        else:
+            write = append
+        return write
+
+    def flush(self):
+        if self.buffer:
+            self.out.write(''.join(self.buffer))
+            del self.buffer[:]
+        self.out.flush()
+
+    def close(self):
+        '''flush the output, the file is not closed'''
+        self.flush()
+
+class NullWriter:
+    '''a Writer dropping all output'''
+    def __init__(self):
+        # a builtin taking one argument is cheaper to call than a Python function
+        self.write = len
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class Reader:
+    '''the INPUT lines from source, a file (sys.stdin by default) or a list
+    of lines.
+
+    readline returns the next line ending with a newline and '' at the end,
+    like file.readline. if output, a Writer, is given it is flushed before
+    every line is read, so that the prompt is shown.'''
+    def __init__(self, source=None, output=None):
+        if source is None:
+            source = sys.stdin
+        if isinstance(source, (list, tuple)):
+            lines = iter([line.rstrip('\n') + '\n' for line in source])
+            self.next_line = lambda: next(lines, '')
+        else:
+            self.next_line = source.readline
+        self.output = output
+
+    def readline(self):
+        if self.output is not None:
+            self.output.flush()
+        return self.next_line()
+
+def standard_io(policy=None):
+    '''a Writer on sys.stdout and a Reader on sys.stdin flushing it.
+
+    the policy defaults to 'line' if stdout is a terminal and to 'size'
+    otherwise.'''
+    if policy is None:
+        policy = 'line' if sys.stdout.isatty() else 'size'
+    output = Writer(sys.stdout, policy)
+    return output, Reader(sys.stdin, output)
@@ -0,0 +1,189 @@
+'''run many BASIC programs in a pool of worker processes.
+
+    python batch.py [-j JOBS] [--timeout SECONDS] [--budget INSTRUCTIONS]
+                    [-o OUTPUT_DIR] MANIFEST
+
+every line of the manifest is a job: a .bas or .bac program and optionally
+a file with its INPUT lines, both relative to the manifest (empty lines and
+lines starting with # are ignored). every program is compiled to byte code
+once, before the workers start; a worker decodes it the first time it runs
+one of its jobs and keeps it for the next ones.
+
+a job's output is captured, with -o it is written to OUTPUT_DIR/N.out for
+the job on line N of the manifest. a job fails when it raises an error,
+runs longer than the timeout or executes more instructions than the
+budget. the report gives the throughput, the percentiles of the job
+latencies and the failed jobs.'''
+
+import sys
+import os
+import time
+import signal
+import argparse
+import multiprocessing
+from StringIO import StringIO
+import parser
+import astopt
+import bytecode
+import basicio
+
+class Timeout(Exception):
+    pass
+
+def read_manifest(path):
+    '''returns the jobs of the manifest as (line number, program, input file)'''
+    base = os.path.dirname(path)
+    jobs = []
+    with open(path, 'r') as manifest:
+        for lineno, line in enumerate(manifest, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            program = os.path.join(base, fields[0])
+            input_file = os.path.join(base, fields[1]) if len(fields) > 1 else None
+            jobs.append((lineno, program, input_file))
+    return jobs
+
+def compile_program(fname):
+    '''the serialized byte code of the program in fname'''
+    if fname.endswith('.bac'):
+        bc_ctx = bytecode.BCContext.load(fname)
+    else:
+        with open(fname, 'r') as infile:
+            ast_ctx = parser.parse(infile)
+        astopt.optimize(ast_ctx)
+        bc_ctx = bytecode.BCContext.from_ast(ast_ctx).optimize()
+    outfile = StringIO()
+    bc_ctx.serialize(outfile)
+    return outfile.getvalue()
+
+# the state of a worker: the serialized programs and those decoded so far
+programs = {}
+decoded = {}
+
+def init_worker(compiled):
+    programs.update(compiled)
+    # ctrl-c stops the runner, not the job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, alarm)
+
+def program(fname):
+    if fname not in decoded:
+        bc_ctx = bytecode.BCContext.from_buffer(programs[fname])
+        decoded[fname] = (bc_ctx,) + bytecode.decode(bc_ctx)
+    return decoded[fname]
+
+def alarm(signum, frame):
+    raise Timeout()
+
+def run_job(job):
+    '''run one job in a worker.
+
+    returns a dict with the line number, the program, the status ('ok',
+    'error', 'timeout' or 'budget'), the error message, the output, the
+    number of instructions executed and the elapsed time.'''
+    lineno, fname, input_file, timeout, budget = job
+    result = {'line': lineno, 'program': fname, 'status': 'ok', 'error': None, 'steps': None}
+    output = basicio.Writer(StringIO(), 'exit')
+    start = time.time()
+    if timeout:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    # the timer is stopped as soon as the job ends, an alarm that is still
+    # delivered afterwards is caught with the errors of the job
+    try:
+        try:
+            lines = []
+            if input_file is not None:
+                with open(input_file, 'r') as infile:
+                    lines = infile.read().splitlines()
+            bc_ctx, ops, args = program(fname)
+            result['steps'] = bytecode.run_decoded(bc_ctx, ops, args, write=output.write,
+                                                   read=basicio.Reader(lines).readline, budget=budget)
+        finally:
+            if timeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except Timeout:
+        result['status'] = 'timeout'
+        result['error'] = 'no end after %gs' % timeout
+    except bytecode.BudgetExceeded as error:
+        result['status'] = 'budget'
+        result['error'] = str(error)
+    except Exception as error:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    result['elapsed'] = time.time() - start
+    output.close()
+    result['output'] = output.out.getvalue()
+    return result
+
+def percentile(values, p):
+    '''the p-th percentile of the sorted values, by the nearest rank'''
+    index = max(0, int(round(p / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+def run_batch(jobs, workers=None, timeout=None, budget=None):
+    '''run the jobs of read_manifest, returns the results of run_job in the
+    order of the jobs'''
+    compiled = {}
+    failed = {}
+    for lineno, fname, input_file in jobs:
+        if fname in compiled or fname in failed:
+            continue
+        try:
+            compiled[fname] = compile_program(fname)
+        except Exception as error:
+            failed[fname] = '%s: %s' % (type(error).__name__, error)
+
+    results = {}
+    work = []
+    for lineno, fname, input_file in jobs:
+        if fname in failed:
+            results[lineno] = {'line': lineno, 'program': fname, 'status': 'compile', 'error': failed[fname],
+                               'steps': None, 'elapsed': 0.0, 'output': ''}
+        else:
+            work.append((lineno, fname, input_file, timeout, budget))
+
+    pool = multiprocessing.Pool(workers, init_worker, (compiled,))
+    try:
+        for result in pool.imap_unordered(run_job, work):
+            results[result['line']] = result
+    finally:
+        pool.close()
+        pool.join()
+    return [results[lineno] for lineno, fname, input_file in jobs]
+
+def report(results, wall_time):
+    latencies = sorted(result['elapsed'] for result in results if result['status'] != 'compile')
+    print '%d jobs in %.3fs, %.1f jobs/s' % (len(results), wall_time, len(results) / wall_time)
+    if latencies:
+        print 'latency  %s' % '  '.join('p%d %.4fs' % (p, percentile(latencies, p)) for p in (50, 90, 99))
+        print 'latency  max %.4fs' % latencies[-1]
+    failures = [result for result in results if result['status'] != 'ok']
+    print '%d failed' % len(failures)
+    for result in failures:
+        print '  line %d %s: %s %s' % (result['line'], result['program'], result['status'], result['error'])
+
+def main():
+    argparser = argparse.ArgumentParser(description='run BASIC programs in a pool of worker processes')
+    argparser.add_argument('manifest', help='file listing a program and an optional input file per line')
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help='number of worker processes (default: one per cpu)')
+    argparser.add_argument('--timeout', type=float, default=None, help='wall clock seconds per job')
+    argparser.add_argument('--budget', type=int, default=None, help='instructions per job')
+    argparser.add_argument('-o', '--output', metavar='OUTPUT_DIR', help='write the output of every job here')
+    args = argparser.parse_args()
+
+    start = time.time()
+    results = run_batch(read_manifest(args.manifest), args.jobs, args.timeout, args.budget)
+    report(results, time.time() - start)
+    if args.output:
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+        for result in results:
+            with open(os.path.join(args.output, '%d.out' % result['line']), 'w') as outfile:
+                outfile.write(result['output'])
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
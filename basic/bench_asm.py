@@ -0,0 +1,59 @@
+'''compare the assembly generated by TAC.compile with and without register
+allocation: size of the .s file, number of instructions and of instructions
+touching memory, and the runtime of the executables where gcc -m32 works.'''
+
+import sys
+import re
+import time
+import subprocess
+import parser
+import tac
+import asmw
+import bench_pygen
+
+memory_operand = re.compile(r'(^|[ ,(])\.L[A-Za-z_0-9]+($|,)')
+
+def statistics(fname):
+    lines = open(fname).read().splitlines()
+    instructions = [line for line in lines if not line.endswith(':') and not line.startswith('.')]
+    memory = [line for line in instructions if memory_operand.search(line.split(None, 1)[-1])
+              and not line.startswith(('j', 'call'))]
+    return len(lines), len(instructions), len(memory)
+
+def build(fname, exe):
+    try:
+        return subprocess.call(['gcc', '-m32', fname, 'lib.c', '-o', exe]) == 0
+    except OSError:
+        return False
+
+def runtime(exe, stdin):
+    proc = subprocess.Popen(['./' + exe], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    start = time.time()
+    proc.communicate(stdin)
+    return time.time() - start
+
+def main(iterations=10000000):
+    programs = [('test', open('test.bas').read(), 'BOB\n30\n'),
+                ('loop', bench_pygen.LOOP % iterations, '')]
+    print '%-6s %-10s %6s %6s %6s %8s' % ('', '', 'lines', 'instr', 'memory', 'time')
+    for name, source, stdin in programs:
+        for mode, register_allocation in [('memory', False), ('registers', True)]:
+            tac_ctx = tac.TAC.fromast(parser.parse(source.splitlines()))
+            tac_ctx.optimize()
+            fname = 'bench_%s_%s.s' % (name, mode)
+            asm = asmw.GASM(fname)
+            tac_ctx.compile(asm, register_allocation)
+            asm.close()
+            lines, instructions, memory = statistics(fname)
+            exe = fname[:-2]
+            if build(fname, exe):
+                elapsed = '%7.3fs' % runtime(exe, stdin)
+            else:
+                elapsed = '     n/a'
+            print '%-6s %-10s %6d %6d %6d %s' % (name, mode, lines, instructions, memory, elapsed)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
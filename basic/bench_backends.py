@@ -0,0 +1,268 @@
+'''run the BASIC workloads under every available backend and compare them.
+
+    python bench_backends.py [-w WARMUP] [-r REPEAT] [-o RESULTS.json] [--astopt]
+                             [--compare BASELINE.json] [--threshold 0.1]
+                             [WORKLOAD.bas ...]
+
+the workloads default to workloads/*.bas; a workload reads its INPUT lines
+from the file of the same name ending in .in, if there is one. every backend
+runs every workload WARMUP times untimed and REPEAT times timed, its output
+must be the same as the one of ASTInterpreter. backends that can not be
+built here (gcc -m32 for TAC.compile, gcc for basic_vm.c) are skipped.
+with --astopt the programs go through astopt.optimize first.
+
+with --compare the median times are checked against a results file of an
+earlier run, a backend that is more than THRESHOLD slower on a workload is
+reported as a regression and the exit status is 1.'''
+
+import sys
+import os
+import glob
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from StringIO import StringIO
+import parser
+import astopt
+import ast_interpreter
+import tac
+import asmw
+import bytecode
+import pygen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def captured(func, stdin):
+    '''call func with stdin as the standard input, returns the output'''
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    sys.stdin = StringIO(stdin)
+    try:
+        func()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+        sys.stdin = sys.__stdin__
+
+# a backend is called with the ASTContext of a workload and a scratch
+# directory. it returns None if it is not available, otherwise a function
+# that prepares a fresh run and returns a function running the program on
+# the given input and returning its output. only the latter is timed.
+
+def ast_backend(ast_ctx, workdir):
+    def setup():
+        return lambda stdin: captured(
+            lambda: ast_interpreter.ASTInterpreter(ast_ctx, sys.stdout.write, sys.stdin.readline).execute(), stdin)
+    return setup
+
+def closure_backend(ast_ctx, workdir):
+    def setup():
+        def run(stdin):
+            def execute():
+                ast_interpreter.ClosureInterpreter(ast_ctx, sys.stdout.write, sys.stdin.readline).execute()
+            return captured(execute, stdin)
+        return run
+    return setup
+
+def tac_backend(ast_ctx, workdir):
+    tac_ctx = tac.TAC.fromast(ast_ctx)
+    tac_ctx.optimize()
+    def setup():
+        return lambda stdin: captured(tac_ctx.interpreter, stdin)
+    return setup
+
+def bytecode_backend(ast_ctx, workdir):
+    bc_ctx = bytecode.BCContext.from_ast(ast_ctx).optimize()
+    def setup():
+        return lambda stdin: captured(lambda: bytecode.run_bytecode(bc_ctx), stdin)
+    return setup
+
+def pygen_backend(ast_ctx, workdir):
+    program = pygen.load_code(pygen.PyModule.from_ast(ast_ctx).compile())
+    def setup():
+        return lambda stdin: captured(lambda: program(sys.stdout.write, sys.stdin.readline), stdin)
+    return setup
+
+def run_process(args, stdin):
+    '''run a program, returns its output; an exit status other than 0 is an error'''
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = proc.communicate(stdin)[0]
+    if proc.returncode:
+        raise RuntimeError('%s exited with status %d' % (os.path.basename(args[0]), proc.returncode))
+    return output
+
+def executable(exe):
+    def setup():
+        return lambda stdin: run_process([exe], stdin)
+    return setup
+
+def gcc(args):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['gcc'] + args, stdout=devnull, stderr=devnull) == 0
+    except OSError:
+        return False
+
+def native_backend(ast_ctx, workdir):
+    tac_ctx = tac.TAC.fromast(ast_ctx)
+    tac_ctx.optimize()
+    fname = os.path.join(workdir, 'program.s')
+    asm = asmw.GASM(fname)
+    tac_ctx.compile(asm)
+    asm.close()
+    exe = os.path.join(workdir, 'program')
+    if not gcc(['-m32', fname, os.path.join(HERE, 'lib.c'), '-o', exe]):
+        return None
+    return executable(exe)
+
+def basic_vm_backend(ast_ctx, workdir):
+    exe = os.path.join(workdir, 'basic_vm')
+    # "opcodes.h" is looked for next to the including file first, so the
+    # source is copied to the scratch directory with a fresh opcodes.h
+    shutil.copy(os.path.join(HERE, 'basic_vm.c'), workdir)
+    bytecode.write_opcodes_h(os.path.join(workdir, 'opcodes.h'))
+    if not gcc(['-std=c99', '-O2', '-I', workdir, '-I', HERE, os.path.join(workdir, 'basic_vm.c'),
+                os.path.join(HERE, 'bc_string.c'), '-o', exe]):
+        return None
+    fname = os.path.join(workdir, 'program.bac')
+    with open(fname, 'wb') as outfile:
+        bytecode.BCContext.from_ast(ast_ctx).optimize().serialize(outfile)
+    def setup():
+        return lambda stdin: run_process([exe, fname], stdin)
+    return setup
+
+# the first backend gives the expected output
+backends = [
+    ('ASTInterpreter', ast_backend),
+    ('ClosureInterpreter', closure_backend),
+    ('TAC.interpreter', tac_backend),
+    ('run_bytecode', bytecode_backend),
+    ('pygen', pygen_backend),
+    ('TAC.compile', native_backend),
+    ('basic_vm', basic_vm_backend)]
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def measure(setup, stdin, warmup, repeat):
+    '''returns the output of the first run and the times of the timed runs'''
+    output = None
+    times = []
+    for i in xrange(warmup + repeat):
+        run = setup()
+        start = time.time()
+        result = run(stdin)
+        elapsed = time.time() - start
+        if output is None:
+            output = result
+        if i >= warmup:
+            times.append(elapsed)
+    return output, times
+
+def bench_workload(fname, warmup, repeat, optimize=False):
+    with open(fname, 'r') as infile:
+        ast_ctx = parser.parse(infile)
+    if optimize:
+        astopt.optimize(ast_ctx)
+    input_file = os.path.splitext(fname)[0] + '.in'
+    stdin = open(input_file).read() if os.path.exists(input_file) else ''
+    results = {}
+    expected = None
+    workdir = tempfile.mkdtemp(prefix='bench_backends')
+    try:
+        for name, backend in backends:
+            start = time.time()
+            setup = backend(ast_ctx, workdir)
+            prepare = time.time() - start
+            if setup is None:
+                results[name] = {'available': False}
+                continue
+            try:
+                output, times = measure(setup, stdin, warmup, repeat)
+            except Exception as error:
+                results[name] = {'available': True, 'error': '%s: %s' % (type(error).__name__, error)}
+                continue
+            if expected is None:
+                expected = output
+            results[name] = {'available': True,
+                             'prepare': prepare,
+                             'times': times,
+                             'best': min(times),
+                             'median': median(times),
+                             'output_ok': output == expected}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def report(results):
+    print '%-14s %-20s %10s %10s %10s  %s' % ('workload', 'backend', 'prepare', 'best', 'median', 'output')
+    for workload in sorted(results):
+        for name, backend in backends:
+            result = results[workload][name]
+            if not result['available']:
+                print '%-14s %-20s %32s  %s' % (workload, name, '', 'not available')
+            elif 'error' in result:
+                print '%-14s %-20s %32s  %s' % (workload, name, '', result['error'])
+            else:
+                print '%-14s %-20s %9.3fs %9.3fs %9.3fs  %s' % (
+                    workload, name, result['prepare'], result['best'], result['median'],
+                    'ok' if result['output_ok'] else 'DIFFERS')
+
+def compare(results, baseline, threshold):
+    '''returns the regressions: (workload, backend, baseline median, median)'''
+    regressions = []
+    for workload in sorted(results):
+        for name, result in sorted(results[workload].items()):
+            old = baseline.get(workload, {}).get(name, {})
+            if 'median' in result and 'median' in old and result['median'] > old['median'] * (1 + threshold):
+                regressions.append((workload, name, old['median'], result['median']))
+    return regressions
+
+def main():
+    argparser = argparse.ArgumentParser(description='benchmark the BASIC backends')
+    argparser.add_argument('workloads', nargs='*', help='.bas files (default: workloads/*.bas)')
+    argparser.add_argument('-w', '--warmup', type=int, default=1, help='untimed runs before the timed ones')
+    argparser.add_argument('-r', '--repeat', type=int, default=5, help='timed runs')
+    argparser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    argparser.add_argument('--astopt', action='store_true', help='optimize the AST of the workloads')
+    argparser.add_argument('--compare', metavar='BASELINE', help='results file to check for regressions')
+    argparser.add_argument('--threshold', type=float, default=0.1,
+                           help='relative slow down of the median counted as a regression')
+    args = argparser.parse_args()
+
+    workloads = args.workloads or sorted(glob.glob(os.path.join(HERE, 'workloads', '*.bas')))
+    results = {}
+    for fname in workloads:
+        name = os.path.splitext(os.path.basename(fname))[0]
+        results[name] = bench_workload(fname, args.warmup, args.repeat, args.astopt)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'warmup': args.warmup,
+                       'repeat': args.repeat,
+                       'astopt': args.astopt,
+                       'results': results}, outfile, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            baseline = json.load(infile)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for workload, name, old, new in regressions:
+            print 'REGRESSION %s %s: median %.3fs, baseline %.3fs (%+.0f%%)' % (
+                workload, name, new, old, 100 * (new / old - 1))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''benchmark the byte code engines: instructions per second of run_bytecode
+against the simple reference loop run_bytecode_simple, with and without
+superinstructions. the output goes to a basicio.NullWriter.'''
+
+import sys
+import time
+import parser
+import bytecode
+import basicio
+
+SOURCE = '''\
+10 DIM I AS INTEGER
+20 DIM S AS INTEGER
+30 DIM T AS STRING
+40 LET I = %d
+50 LET S = S + I + I
+60 LET I = I - 1
+70 LET T = "X"
+80 IF I = 0 THEN GOTO 100
+90 GOTO 50
+100 PRINT "SUM: "; S; T
+110 END
+'''
+
+def best_time(func, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(iterations=100000, repeat=3):
+    ast_ctx = parser.parse((SOURCE % iterations).splitlines())
+    bc_ctx = bytecode.BCContext.from_ast(ast_ctx)
+    ops, args = bytecode.decode(bc_ctx)
+    null = basicio.NullWriter()
+    steps = bytecode.run_decoded(bc_ctx, ops, args, count=True, write=null.write)
+    print '%d instructions executed per run' % steps
+    opt_ctx = bytecode.BCContext.from_ast(ast_ctx).optimize()
+    # the optimized program executes fewer instructions, its rate is given
+    # in instructions of the unoptimized program per second
+    for name, func in [('run_bytecode_simple', lambda: bytecode.run_bytecode_simple(bc_ctx, null.write)),
+                       ('run_bytecode', lambda: bytecode.run_bytecode(bc_ctx, write=null.write)),
+                       ('optimized', lambda: bytecode.run_bytecode(opt_ctx, write=null.write))]:
+        elapsed = best_time(func, repeat)
+        print '%-20s %8.3fs %12.0f instr/s' % (name, elapsed, steps / elapsed)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,30 @@
+'''parse synthetic BASIC programs of growing size and report the time per line.
+
+every line uses a new integer and a new string constant, so the constant
+pools grow with the program. linear scaling shows as a constant time per line.'''
+
+import sys
+import time
+import parser
+
+def program(nb_lines):
+    lines = ['1 DIM I AS INTEGER', '2 DIM S AS STRING']
+    for n in xrange(nb_lines // 2):
+        lines.append('%d LET I = I * %d + %d - I / 3' % (10 + 2 * n, n, n + 1))
+        lines.append('%d IF I = %d THEN PRINT "LINE %d"; S; I' % (11 + 2 * n, n, n))
+    lines.append('%d END' % (10 + nb_lines))
+    return lines
+
+def main(sizes=(1000, 10000, 100000)):
+    for size in sizes:
+        lines = program(size)
+        start = time.time()
+        parser.parse(lines)
+        elapsed = time.time() - start
+        print '%8d lines %8.3fs %8.2fus/line' % (len(lines), elapsed, 1e6 * elapsed / len(lines))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(arg) for arg in sys.argv[1:]])
+    else:
+        main()
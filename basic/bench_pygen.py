@@ -0,0 +1,83 @@
+'''compare the Python hosted executors with the Python translation of a program.
+
+every executor runs the same programs with the same input, the outputs
+must agree.'''
+
+import sys
+import time
+from StringIO import StringIO
+import parser
+import ast_interpreter
+import tac
+import bytecode
+import pygen
+
+LOOP = '''\
+10 DIM I AS INTEGER
+20 DIM S AS INTEGER
+30 DIM T AS STRING
+40 LET I = %d
+50 LET S = S + I * 2
+60 LET I = I - 1
+70 LET T = "X"
+80 IF I = 0 THEN GOTO 100
+90 GOTO 50
+100 PRINT "SUM: "; S; T
+110 END
+'''
+
+def run_ast(ast_ctx):
+    ast_interpreter.ASTInterpreter(ast_ctx, sys.stdout.write, sys.stdin.readline).execute()
+
+def run_closures(ast_ctx):
+    ast_interpreter.ClosureInterpreter(ast_ctx, sys.stdout.write, sys.stdin.readline).execute()
+
+def run_tac(ast_ctx):
+    tac.TAC.fromast(ast_ctx).interpreter()
+
+def run_bytecode(ast_ctx):
+    bytecode.run_bytecode(bytecode.BCContext.from_ast(ast_ctx).optimize())
+
+def run_python(ast_ctx):
+    code = pygen.PyModule.from_ast(ast_ctx).compile()
+    pygen.load_code(code)(sys.stdout.write, sys.stdin.readline)
+
+executors = [
+    ('ASTInterpreter', run_ast),
+    ('ClosureInterpreter', run_closures),
+    ('TAC.interpreter', run_tac),
+    ('run_bytecode', run_bytecode),
+    ('pygen', run_python)]
+
+def run(func, ast_ctx, stdin):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    sys.stdin = StringIO(stdin)
+    try:
+        start = time.time()
+        func(ast_ctx)
+        elapsed = time.time() - start
+        return elapsed, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+        sys.stdin = sys.__stdin__
+
+def main(iterations=100000):
+    programs = [('test.bas', open('test.bas').read(), 'BOB\n30\n'),
+                ('loop', LOOP % iterations, '')]
+    for name, source, stdin in programs:
+        ast_ctx = parser.parse(source.splitlines())
+        print name
+        expected = None
+        for executor, func in executors:
+            elapsed, output = run(func, ast_ctx, stdin)
+            if expected is None:
+                expected = output
+            status = 'ok' if output == expected else 'OUTPUT DIFFERS'
+            print '  %-20s %8.3fs  %s' % (executor, elapsed, status)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
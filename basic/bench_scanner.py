@@ -0,0 +1,48 @@
+'''scan a large synthetic BASIC file and report tokens per second, for a
+string read into memory and for the mmap'd file, with and without
+whitespace tokens.'''
+
+import sys
+import os
+import mmap
+import time
+import tempfile
+import scanner
+import bench_parser
+
+def count_tokens(source, skip_whitespace):
+    nb_tokens = 0
+    for _ in scanner.scan(source, skip_whitespace):
+        nb_tokens += 1
+    return nb_tokens
+
+def report(name, source, skip_whitespace):
+    start = time.time()
+    nb_tokens = count_tokens(source, skip_whitespace)
+    elapsed = time.time() - start
+    print '%-28s %9d tokens %8.3fs %10.0f tokens/s' % (name, nb_tokens, elapsed, nb_tokens / elapsed)
+
+def main(nb_lines=100000):
+    fd, filename = tempfile.mkstemp(suffix='.bas')
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            outfile.write('\n'.join(bench_parser.program(nb_lines)) + '\n')
+        with open(filename, 'r') as infile:
+            source = infile.read()
+            buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                print '%d lines, %d bytes' % (source.count('\n'), len(source))
+                report('string', source, False)
+                report('string, skip whitespace', source, True)
+                report('mmap', buf, False)
+                report('mmap, skip whitespace', buf, True)
+            finally:
+                buf.close()
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
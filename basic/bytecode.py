@@ -1,6 +1,15 @@
 import sys
+import os
 import struct
+import mmap
+import bisect
+from array import array
+from collections import Counter
 import parser
+import astopt
+import lineprofile
+import basicio
+import tac
 
 operations = {'add_int', 'sub_int', 'mul_int', 'div_int', 'eq_int', 'eq_str', 'cat_str'}
 opnames = [
@@ -25,29 +34,81 @@ opnames = [
  'input_str',
  'save_str',
  'jmp',
- 'jmpz'
+ 'jmpz',
+ # superinstructions produced by BCContext.optimize
+ 'add_const_int',
+ 'sub_const_int',
+ 'jne_int',
+ 'print_const_str',
+ 'print_var_int',
+ 'print_var_str',
+ 'hasarg2',
+ # instructions with two operands
+ 'inc_int',
+ 'dec_int',
+ # high 16 bits of the operand of the following instruction. it has one
+ # operand but comes last so that the older opcodes keep their numbers.
+ 'ext',
  ]
 opcodes = {name:i for i,name in enumerate(opnames)}
+jumps = {opcodes['jmp'], opcodes['jmpz'], opcodes['jne_int']}
+
+# .bac container. version 1 files have no magic and start directly with
+# HEADER_V1; version 2 files start with MAGIC, the version and a flags word,
+# followed by HEADER_V2 with 32 bit section lengths. the sections follow in
+# the order const_int, const_str, code in both versions. with FLAG_LINES a
+# version 2 file ends with the line table: its length and (code offset,
+# BASIC line number) pairs.
+MAGIC = 'LBAC'
+VERSION = 2
+HEADER_V1 = '<HHHHH'
+HEADER_V2 = '<4sHHLLLLL'
+FLAG_LINES = 1
+
+# sequences replaced by BCContext.optimize, longest first.
+# chosen from the dynamic opcode pair counts reported by `bytecode.py --pairs`
+# on test.bas and the bench_bytecode.py loop, where the top pairs are
+# load_const_int/sub_int, load_const_int/add_int, eq_int/jmpz,
+# load_int/print_int and load_const_str/print_str.
+# each entry is (pattern, replacement, operand builder).
+fusions = [
+    (('load_int', 'load_const_int', 'sub_int', 'save_int'), 'dec_int',
+        lambda a: (a[0], a[1]) if a[0] == a[3] else None),
+    (('load_int', 'load_const_int', 'add_int', 'save_int'), 'inc_int',
+        lambda a: (a[0], a[1]) if a[0] == a[3] else None),
+    (('load_const_int', 'add_int'), 'add_const_int', lambda a: a[0]),
+    (('load_const_int', 'sub_int'), 'sub_const_int', lambda a: a[0]),
+    (('eq_int', 'jmpz'), 'jne_int', lambda a: a[1]),
+    (('load_const_str', 'print_str'), 'print_const_str', lambda a: a[0]),
+    (('load_int', 'print_int'), 'print_var_int', lambda a: a[0]),
+    (('load_str', 'print_str'), 'print_var_str', lambda a: a[0]),
+    ]
 
 class BCContext():
     @classmethod
     def from_ast(cls, ast_context):
         self = cls()
-        self.code = []
+        # instructions are collected as parallel opcode and operand lists
+        # with jump targets given as instruction numbers, see encode
+        self.ops = []
+        self.args = []
         self.jmps = []
 
         jpos = {}
     
         for ln, instr in enumerate(ast_context.code):
-            jpos[ln] = len(self.code)
+            jpos[ln] = len(self.ops)
             self.translate_instr(instr)
             #code.append(('dbg',))
-        for codepos, label in self.jmps:
-            ah, al = divmod(jpos[ast_context.labels[label]], 256)
-            self.code[codepos+1] = al
-            self.code[codepos+2] = ah
-            
-        del self.jmps
+        for pos, label in self.jmps:
+            self.args[pos] = jpos[ast_context.labels[label]]
+
+        self.code = encode(self.ops, self.args)
+        offsets = instruction_offsets(self.code)
+        self.lines = [(offsets[jpos[ln]], lineno)
+                      for ln, lineno in sorted(lineprofile.code_lines(ast_context.labels).items())
+                      if ln in jpos]
+        del self.ops, self.args, self.jmps
         self.nb_int = ast_context.nb_int
         self.nb_str = ast_context.nb_str
         self.const_int = ast_context.const_int
@@ -56,17 +117,55 @@ class BCContext():
 
     @classmethod
     def from_file(cls, infile):
+        '''load a version 1 or version 2 .bac file'''
+        return cls.from_buffer(infile.read())
+
+    @classmethod
+    def load(cls, fname):
+        '''load a .bac file by mapping it into memory'''
+        with open(fname, 'rb') as infile:
+            # an empty file can not be mapped
+            if os.fstat(infile.fileno()).st_size == 0:
+                return cls.from_buffer('')
+            buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return cls.from_buffer(buf)
+            finally:
+                buf.close()
+
+    @classmethod
+    def from_buffer(cls, buf):
+        if len(buf) < struct.calcsize(HEADER_V1):
+            raise ValueError('not a .bac file: %d bytes are too short for a header' % len(buf))
         self = cls()
-        code_length, self.nb_int, self.nb_str, nb_const_int, nb_const_str = struct.unpack('<HHHHH', infile.read(10))
-        self.const_int = [
-            struct.unpack('<l', infile.read(4))[0] for _ in xrange(nb_const_int)]
+        flags = 0
+        if buf[:len(MAGIC)] == MAGIC:
+            (magic, version, flags, code_length, self.nb_int, self.nb_str,
+             nb_const_int, nb_const_str) = struct.unpack_from(HEADER_V2, buf)
+            if version != VERSION:
+                raise ValueError('unsupported .bac version %d' % version)
+            pos = struct.calcsize(HEADER_V2)
+        else:
+            (code_length, self.nb_int, self.nb_str,
+             nb_const_int, nb_const_str) = struct.unpack_from(HEADER_V1, buf)
+            pos = struct.calcsize(HEADER_V1)
+        self.const_int = list(struct.unpack_from('<%dl' % nb_const_int, buf, pos))
+        pos += 4 * nb_const_int
         self.const_str = []
         for _ in xrange(nb_const_str):
-            length = struct.unpack('<L', infile.read(4))[0]
-            self.const_str.append(infile.read(length))
-        self.code = []
-        for _ in xrange(code_length):
-            self.code.append(struct.unpack('<B', infile.read(1))[0])
+            length, = struct.unpack_from('<L', buf, pos)
+            pos += 4
+            self.const_str.append(buf[pos:pos+length])
+            pos += length
+        self.code = array('B', buf[pos:pos+code_length])
+        if len(self.code) != code_length:
+            raise ValueError('truncated .bac file')
+        pos += code_length
+        self.lines = None
+        if flags & FLAG_LINES:
+            nb_lines, = struct.unpack_from('<L', buf, pos)
+            table = struct.unpack_from('<%dL' % (2 * nb_lines), buf, pos + 4)
+            self.lines = zip(table[::2], table[1::2])
         return self
 
     
@@ -93,15 +192,13 @@ class BCContext():
             self.emit('save_' + instr[1], instr[2])
         elif instr[0] == 'if':
             self.translate_expr(instr[1])
-            jmp_instr = len(self.code)
-            self.emit('jmpz', 0xdead)
+            jmp_instr = len(self.ops)
+            self.emit('jmpz', None)
             self.translate_instr(instr[2])
-            ah, al = divmod(len(self.code), 256)
-            self.code[jmp_instr+1] = al
-            self.code[jmp_instr+2] = ah
+            self.args[jmp_instr] = len(self.ops)
         elif instr[0] == 'goto':
-            self.jmps.append((len(self.code), instr[1]))
-            self.emit('jmp', 0xdead)
+            self.jmps.append((len(self.ops), instr[1]))
+            self.emit('jmp', None)
         elif instr[0] == 'print':
             for ex in instr[1:]:
                 self.translate_expr(ex)
@@ -113,20 +210,68 @@ class BCContext():
             assert False, instr
             
     def emit(self, mnemonic, arg=None):
-        self.code.append(opcodes[mnemonic])
-        if arg is not None:
-            ah, al = divmod(arg, 256)
-            self.code.append(al)
-            self.code.append(ah)
+        self.ops.append(opcodes[mnemonic])
+        self.args.append(arg)
 
     
+    def optimize(self):
+        '''replace common instruction sequences by superinstructions'''
+        ops, args = decode(self)
+        line_starts = {}
+        if self.lines is not None:
+            index = dict((offset, i) for i, offset in enumerate(instruction_offsets(self.code)))
+            line_starts = dict((index[offset], lineno) for offset, lineno in self.lines)
+        targets = {args[i] for i, op in enumerate(ops) if op in jumps}
+        patterns = [(tuple(opcodes[name] for name in pattern), opcodes[replacement], operands)
+                    for pattern, replacement, operands in fusions]
+        new_ops = []
+        new_args = []
+        new_index = {}
+        i = 0
+        while i < len(ops):
+            new_index[i] = len(new_ops)
+            for pattern, replacement, operands in patterns:
+                n = len(pattern)
+                if (tuple(ops[i:i+n]) == pattern
+                        and not any(j in targets for j in xrange(i+1, i+n))):
+                    arg = operands(args[i:i+n])
+                    if arg is not None and not (isinstance(arg, tuple) and max(arg) > 0xffff):
+                        for j in xrange(i+1, i+n):
+                            new_index[j] = len(new_ops)
+                        new_ops.append(replacement)
+                        new_args.append(arg)
+                        i += n
+                        break
+            else:
+                new_ops.append(ops[i])
+                new_args.append(args[i])
+                i += 1
+        new_index[i] = len(new_ops)
+        for i, op in enumerate(new_ops):
+            if op in jumps:
+                new_args[i] = new_index[new_args[i]]
+        self.code = encode(new_ops, new_args)
+        if self.lines is not None:
+            # a line whose start was fused into the line before it disappears
+            offsets = instruction_offsets(self.code)
+            new_lines = {}
+            for i, lineno in sorted(line_starts.items()):
+                new_lines.setdefault(offsets[new_index[i]], lineno)
+            self.lines = sorted(new_lines.items())
+        return self
+
     def disassemble(self):
         ip = 0
         while ip<len(self.code):
             bytecode = self.code[ip]
             mnemonic = opnames[bytecode]
             ip += 1
-            if bytecode > opcodes['hasarg']:
+            if bytecode > opcodes['hasarg2'] and bytecode != opcodes['ext']:
+                arg1 = self.code[ip] + 256 * self.code[ip+1]
+                arg2 = self.code[ip+2] + 256 * self.code[ip+3]
+                ip += 4
+                print '%3d: %s %d %d' % (ip, mnemonic, arg1, arg2)
+            elif bytecode > opcodes['hasarg']:
                 arg = self.code[ip] + 256 * self.code[ip+1]
                 ip += 2
                 print '%3d: %s %d' % (ip, mnemonic, arg)
@@ -134,17 +279,396 @@ class BCContext():
                 print '%3d: %s' % (ip, mnemonic)
                 
     def serialize(self, outfile):
-        outfile.write(struct.pack('<HHHHH', len(self.code), self.nb_int, self.nb_str, len(self.const_int), len(self.const_str)))
-        for i in self.const_int:
-            outfile.write(struct.pack('<l', i))
+        flags = FLAG_LINES if self.lines is not None else 0
+        outfile.write(struct.pack(HEADER_V2, MAGIC, VERSION, flags, len(self.code), self.nb_int, self.nb_str,
+                                  len(self.const_int), len(self.const_str)))
+        outfile.write(struct.pack('<%dl' % len(self.const_int), *self.const_int))
         for s in self.const_str:
             outfile.write(struct.pack('<L', len(s)))
             outfile.write(s)
-        for c in self.code:
-            outfile.write(struct.pack('<B', c))
-            
+        outfile.write(array('B', self.code).tostring())
+        if self.lines is not None:
+            outfile.write(struct.pack('<L', len(self.lines)))
+            outfile.write(struct.pack('<%dL' % (2 * len(self.lines)),
+                                      *[x for line in self.lines for x in line]))
+
+    def line_of(self, offset):
+        '''the BASIC line of the instruction at offset'''
+        if not self.lines:
+            raise ValueError('the byte code has no line table')
+        i = bisect.bisect_right(self.lines, (offset, sys.maxint)) - 1
+        return self.lines[max(i, 0)][1]
             
-def run_bytecode(bc_context):
+
+def instruction_offsets(code):
+    '''the offset of every instruction in the order of decode. the offset of
+    an instruction with an ext prefix is that of the prefix.'''
+    hasarg = opcodes['hasarg']
+    hasarg2 = opcodes['hasarg2']
+    ext = opcodes['ext']
+    offsets = []
+    start = None
+    ip = 0
+    while ip < len(code):
+        op = code[ip]
+        if start is None:
+            start = ip
+        if op == ext:
+            ip += 3
+            continue
+        offsets.append(start)
+        start = None
+        if op > hasarg2:
+            ip += 5
+        elif op > hasarg:
+            ip += 3
+        else:
+            ip += 1
+    return offsets
+
+
+def decode(bc_context):
+    '''decode the byte code once into parallel lists of opcodes and operands.
+
+    instructions are numbered consecutively and jump operands are translated
+    from byte offsets into instruction numbers.'''
+    code = bc_context.code
+    hasarg = opcodes['hasarg']
+    hasarg2 = opcodes['hasarg2']
+    ext = opcodes['ext']
+    ops = []
+    args = []
+    index = {}
+    high = 0
+    ip = 0
+    while ip < len(code):
+        op = code[ip]
+        if op == ext:
+            # a jump to an extended instruction targets its prefix
+            index[ip] = len(ops)
+            high = code[ip+1] + 256 * code[ip+2]
+            ip += 3
+            continue
+        index.setdefault(ip, len(ops))
+        ops.append(op)
+        if op > hasarg2:
+            args.append((code[ip+1] + 256 * code[ip+2], code[ip+3] + 256 * code[ip+4]))
+            ip += 5
+        elif op > hasarg:
+            args.append((high << 16) + code[ip+1] + 256 * code[ip+2])
+            high = 0
+            ip += 3
+        else:
+            args.append(None)
+            ip += 1
+    index[ip] = len(ops)
+    for i, op in enumerate(ops):
+        if op in jumps:
+            args[i] = index[args[i]]
+    return ops, args
+
+
+def encode(ops, args):
+    '''the inverse of decode: jump operands are instruction numbers.
+
+    operands above 0xffff get an ext prefix carrying their high 16 bits.
+    a jump needs a prefix when its target offset is above 0xffff, which in
+    turn moves the following code, so the layout is repeated until no
+    further jump has to be widened.'''
+    hasarg = opcodes['hasarg']
+    hasarg2 = opcodes['hasarg2']
+    ext = opcodes['ext']
+    wide = set()
+    while True:
+        offsets = []
+        ip = 0
+        for i, op in enumerate(ops):
+            offsets.append(ip)
+            if op > hasarg2:
+                ip += 5
+            elif op in jumps:
+                ip += 6 if i in wide else 3
+            elif op > hasarg:
+                ip += 6 if args[i] > 0xffff else 3
+            else:
+                ip += 1
+        offsets.append(ip)
+        grown = {i for i, op in enumerate(ops)
+                 if op in jumps and i not in wide and offsets[args[i]] > 0xffff}
+        if not grown:
+            break
+        wide |= grown
+    code = []
+    for i, op in enumerate(ops):
+        arg = args[i]
+        if op in jumps:
+            arg = offsets[arg]
+        if op > hasarg2:
+            assert max(arg) <= 0xffff, arg
+            code.append(op)
+            code.extend(divmod(arg[0], 256)[::-1])
+            code.extend(divmod(arg[1], 256)[::-1])
+        elif op > hasarg:
+            assert 0 <= arg <= 0xffffffff, arg
+            if i in wide or arg > 0xffff:
+                code.append(ext)
+                code.extend(divmod(arg >> 16, 256)[::-1])
+            code.append(op)
+            code.extend(divmod(arg & 0xffff, 256)[::-1])
+        else:
+            code.append(op)
+    return code
+
+
+def opcode_pairs(bc_context):
+    '''run the program and count how often each pair of opcodes is executed in sequence'''
+    ops, args = decode(bc_context)
+    pairs = Counter()
+    previous = [None]
+    def trace(pc):
+        op = opnames[ops[pc]]
+        pairs[previous[0], op] += 1
+        previous[0] = op
+    run_decoded(bc_context, ops, args, trace=trace)
+    del pairs[None, opnames[ops[0]]]
+    return pairs
+
+
+class BudgetExceeded(Exception):
+    '''the program did not end within its instruction budget'''
+
+
+def run_decoded(bc_context, ops, args, count=False, trace=None, profile=None, write=None, read=None,
+                budget=None):
+    '''execute decoded byte code.
+
+    every instruction is a single call of its handler with the operand and
+    the number of the following instruction; the handler returns the number
+    of the instruction to execute next, or -1 to stop.
+    if count is true the number of executed instructions is returned.
+    with a budget BudgetExceeded is raised before more than budget
+    instructions are executed; a budget can not be combined with trace or
+    profile.
+    trace is called with the instruction number before each instruction.
+    profile, a lineprofile.LineProfile, is told about every BASIC line that
+    starts executing; this needs the line table of bc_context.
+    the output goes to write and the INPUT lines come from read, by default
+    sys.stdout.write and sys.stdin.readline.'''
+    istack = []
+    sstack = []
+    ipush = istack.append
+    ipop = istack.pop
+    spush = sstack.append
+    spop = sstack.pop
+    integers = [0] * bc_context.nb_int
+    strings = [''] * bc_context.nb_str
+    const_int = bc_context.const_int
+    const_str = bc_context.const_str
+    if write is None:
+        write = sys.stdout.write
+    if read is None:
+        read = sys.stdin.readline
+
+    def end(arg, pc):
+        return -1
+
+    def load_int(arg, pc):
+        ipush(integers[arg])
+        return pc
+
+    def load_str(arg, pc):
+        spush(strings[arg])
+        return pc
+
+    def load_const_int(arg, pc):
+        ipush(const_int[arg])
+        return pc
+
+    def load_const_str(arg, pc):
+        spush(const_str[arg])
+        return pc
+
+    def input_int(arg, pc):
+        integers[arg] = int(read())
+        return pc
+
+    def input_str(arg, pc):
+        strings[arg] = read().rstrip('\n')
+        return pc
+
+    def save_int(arg, pc):
+        integers[arg] = ipop()
+        return pc
+
+    def save_str(arg, pc):
+        strings[arg] = spop()
+        return pc
+
+    def print_int(arg, pc):
+        write(str(ipop()))
+        return pc
+
+    def print_str(arg, pc):
+        write(spop())
+        return pc
+
+    def println(arg, pc):
+        write('\n')
+        return pc
+
+    def add_int(arg, pc):
+        tmp = ipop()
+        ipush(ipop() + tmp)
+        return pc
+
+    def sub_int(arg, pc):
+        tmp = ipop()
+        ipush(ipop() - tmp)
+        return pc
+
+    def mul_int(arg, pc):
+        tmp = ipop()
+        ipush(ipop() * tmp)
+        return pc
+
+    def div_int(arg, pc):
+        tmp = ipop()
+        ipush(tac.div_int(ipop(), tmp))
+        return pc
+
+    def eq_int(arg, pc):
+        ipush(int(ipop() == ipop()))
+        return pc
+
+    def cat_str(arg, pc):
+        tmp = spop()
+        spush(spop() + tmp)
+        return pc
+
+    def eq_str(arg, pc):
+        ipush(int(spop() == spop()))
+        return pc
+
+    def jmp(arg, pc):
+        return arg
+
+    def jmpz(arg, pc):
+        if ipop():
+            return pc
+        return arg
+
+    def add_const_int(arg, pc):
+        ipush(ipop() + const_int[arg])
+        return pc
+
+    def sub_const_int(arg, pc):
+        ipush(ipop() - const_int[arg])
+        return pc
+
+    def jne_int(arg, pc):
+        if ipop() == ipop():
+            return pc
+        return arg
+
+    def print_const_str(arg, pc):
+        write(const_str[arg])
+        return pc
+
+    def print_var_int(arg, pc):
+        write(str(integers[arg]))
+        return pc
+
+    def print_var_str(arg, pc):
+        write(strings[arg])
+        return pc
+
+    def inc_int(arg, pc):
+        var, const = arg
+        integers[var] += const_int[const]
+        return pc
+
+    def dec_int(arg, pc):
+        var, const = arg
+        integers[var] -= const_int[const]
+        return pc
+
+    table = {
+        'end': end,
+        'load_int': load_int,
+        'load_str': load_str,
+        'load_const_int': load_const_int,
+        'load_const_str': load_const_str,
+        'input_int': input_int,
+        'input_str': input_str,
+        'save_int': save_int,
+        'save_str': save_str,
+        'print_int': print_int,
+        'print_str': print_str,
+        'println': println,
+        'add_int': add_int,
+        'sub_int': sub_int,
+        'mul_int': mul_int,
+        'div_int': div_int,
+        'eq_int': eq_int,
+        'cat_str': cat_str,
+        'eq_str': eq_str,
+        'jmp': jmp,
+        'jmpz': jmpz,
+        'add_const_int': add_const_int,
+        'sub_const_int': sub_const_int,
+        'jne_int': jne_int,
+        'print_const_str': print_const_str,
+        'print_var_int': print_var_int,
+        'print_var_str': print_var_str,
+        'inc_int': inc_int,
+        'dec_int': dec_int}
+    handlers = [table[opnames[op]] for op in ops]
+
+    pc = 0
+    if budget is not None and (profile is not None or trace is not None):
+        raise ValueError('an instruction budget can not be used with trace or profile')
+    if profile is not None:
+        if not bc_context.lines:
+            raise ValueError('the byte code has no line table')
+        line_at = [None] * len(ops)
+        index = dict((offset, i) for i, offset in enumerate(instruction_offsets(bc_context.code)))
+        for offset, lineno in bc_context.lines:
+            line_at[index[offset]] = lineno
+        while pc >= 0:
+            if line_at[pc] is not None:
+                profile.enter(line_at[pc])
+            pc = handlers[pc](args[pc], pc + 1)
+        profile.stop()
+        return
+    if trace is not None:
+        while pc >= 0:
+            trace(pc)
+            pc = handlers[pc](args[pc], pc + 1)
+        return
+    if count or budget is not None:
+        limit = sys.maxint if budget is None else budget
+        steps = 0
+        while pc >= 0:
+            if steps == limit:
+                raise BudgetExceeded('no end after %d instructions' % limit)
+            steps += 1
+            pc = handlers[pc](args[pc], pc + 1)
+        return steps
+    while pc >= 0:
+        pc = handlers[pc](args[pc], pc + 1)
+
+
+def run_bytecode(bc_context, profile=None, write=None, read=None, budget=None):
+    ops, args = decode(bc_context)
+    run_decoded(bc_context, ops, args, profile=profile, write=write, read=read, budget=budget)
+
+
+def run_bytecode_simple(bc_context, write=None, read=None):
+    '''the straightforward reference loop, decoding each instruction as it runs'''
+    if write is None:
+        write = sys.stdout.write
+    if read is None:
+        read = sys.stdin.readline
     ip = 0
     istack = []
     sstack = []
@@ -174,9 +698,9 @@ def run_bytecode(bc_context):
             spush(bc_context.const_str[arg])
 
         elif mnemonic == 'input_int':
-            integers[arg] = int(raw_input())
+            integers[arg] = int(read())
         elif mnemonic == 'input_str':
-            strings[arg] = raw_input()
+            strings[arg] = read().rstrip('\n')
             
         elif mnemonic == 'save_int':
             integers[arg] = ipop()
@@ -184,11 +708,11 @@ def run_bytecode(bc_context):
             strings[arg] = spop()
             
         elif mnemonic == 'print_str':
-            sys.stdout.write(spop())
+            write(spop())
         elif mnemonic == 'print_int':
-            sys.stdout.write(str(ipop()))
+            write(str(ipop()))
         elif mnemonic == 'println':
-            print
+            write('\n')
 
         elif mnemonic == 'add_int':
             tmp = ipop()
@@ -223,28 +747,55 @@ def run_bytecode(bc_context):
             assert False, mnemonic
 
 
-def write_opcodes_h():     
-    with open('opcodes.h', 'w') as f:
-        f.write('static const char* opnames[] = {\n' + 
-                ',\n'.join('"%s"' % name for name in opnames) + 
-                '\n};\n')
-        f.write('enum opcodes{')
-        for i, name in enumerate(opnames):
-            f.write('    op_%s = %d,\n' % (name, i))
-        f.write('};\n')
-write_opcodes_h()
+def write_opcodes_h(fname='opcodes.h'):
+    '''write the opcode table for basic_vm.c, unless fname is up to date'''
+    text = ('static const char* opnames[] = {\n' +
+            ',\n'.join('"%s"' % name for name in opnames) +
+            '\n};\n' +
+            'enum opcodes{' +
+            ''.join('    op_%s = %d,\n' % (name, i) for i, name in enumerate(opnames)) +
+            '};\n')
+    try:
+        with open(fname, 'r') as f:
+            if f.read() == text:
+                return
+    except IOError:
+        pass
+    with open(fname, 'w') as f:
+        f.write(text)
 
-def main(fname):
+def main(fname, profile=None):
     if fname.endswith('.bac'):
-        with open(fname, 'rb') as infile:
-            bc_ctx = BCContext.from_file(infile)
+        bc_ctx = BCContext.load(fname)
     else:
         with open(fname, 'r') as infile:
             ast_ctx = parser.parse(infile)
-        bc_ctx = BCContext.from_ast(ast_ctx)
+        astopt.optimize(ast_ctx)
+        bc_ctx = BCContext.from_ast(ast_ctx).optimize()
         with open('test.bac', 'wb') as outfile:
             bc_ctx.serialize(outfile)        
-    run_bytecode(bc_ctx)
+    output, reader = basicio.standard_io()
+    try:
+        run_bytecode(bc_ctx, profile, output.write, reader.readline)
+    finally:
+        output.close()
+    if profile is not None:
+        profile.report()
+
+def print_pairs(fnames):
+    pairs = Counter()
+    for fname in fnames:
+        with open(fname, 'r') as infile:
+            ast_ctx = parser.parse(infile)
+        pairs.update(opcode_pairs(BCContext.from_ast(ast_ctx)))
+    for (first, second), n in pairs.most_common():
+        print '%10d  %s %s' % (n, first, second)
 
 if __name__ == '__main__':
-    main(sys.argv[1])
+    write_opcodes_h()
+    if sys.argv[1] == '--pairs':
+        print_pairs(sys.argv[2:])
+    elif sys.argv[1] == '--profile':
+        main(sys.argv[2], lineprofile.LineProfile())
+    else:
+        main(sys.argv[1])
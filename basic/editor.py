@@ -7,8 +7,12 @@ import parser
 import sys
 import Queue as queue
 import threading
+import collections
 
 class Editor(tk.Text):
+    # number of lines highlighted per idle time slice
+    slice_lines = 200
+
     def __init__(self, master, source='', **conf):
         tk.Text.__init__(self, master, font=('Courier', 12), wrap='none', **conf)
         self.tag_config('keyword', foreground='blue', font=('Courier', 12, 'bold'))
@@ -16,11 +20,29 @@ class Editor(tk.Text):
         self.tag_config('string', foreground='forestgreen', font=('Courier', 12, 'italic'))
         self.bind('<<modified>>', self.modified)
         self.bind('<KeyRelease>', self.modified)
+        # line number -> hash of the line text when it was last highlighted
+        self.line_hashes = {}
+        self.nb_lines = 1
+        # next line of the background highlighting pass
+        self.pending = 1
+        self.idle_job = None
         self.set_text(source)
         self.dirty = False
         
+    def line_count(self):
+        return int(self.index('end-1c').split('.')[0])
+
+    def visible_lines(self):
+        first = int(self.index('@0,0').split('.')[0])
+        last = int(self.index('@0,%d' % self.winfo_height()).split('.')[0])
+        return first, last
+
     def highlight(self, line):
         line_txt = self.get('%d.0' % line, '%d.end' % line)
+        line_hash = hash(line_txt)
+        if self.line_hashes.get(line) == line_hash:
+            return
+        self.line_hashes[line] = line_hash
         self.tag_remove('keyword', '%d.0' % line, '%d.end' % line)
         self.tag_remove('string', '%d.0' % line, '%d.end' % line)
         self.tag_remove('error', '%d.0' % line, '%d.end' % line)
@@ -31,29 +53,71 @@ class Editor(tk.Text):
                 self.tag_add('string', '%d.%d' % (line, token.start), '%d.%d' % (line, token.end))
             elif token.type == 'error':
                 self.tag_add('error', '%d.%d' % (line, token.start), '%d.%d' % (line, token.end))
-                
-    def highlight_all(self):
-        for line in range(int(self.index('end').split('.')[0])):
+
+    def highlight_visible(self):
+        first, last = self.visible_lines()
+        for line in xrange(first, last + 1):
             self.highlight(line)
-            
+
+    def highlight_all(self, start=1):
+        '''highlight the visible lines now and all lines from start on in idle time'''
+        self.highlight_visible()
+        if self.idle_job is None:
+            self.pending = start
+            self.idle_job = self.after_idle(self.highlight_slice)
+        else:
+            self.pending = min(self.pending, start)
+
+    def highlight_slice(self):
+        # the viewport comes first, it may have scrolled since the last slice
+        self.highlight_visible()
+        stop = min(self.pending + self.slice_lines, self.line_count() + 1)
+        for line in xrange(self.pending, stop):
+            self.highlight(line)
+        self.pending = stop
+        if stop <= self.line_count():
+            self.idle_job = self.after_idle(self.highlight_slice)
+        else:
+            self.idle_job = None
+
     def modified(self, event):
         line = int(self.index('insert').split('.')[0])
+        nb_lines = self.line_count()
+        if nb_lines != self.nb_lines:
+            # lines were inserted or removed, everything below has moved
+            start = max(1, line - abs(nb_lines - self.nb_lines))
+            for stale in [l for l in self.line_hashes if l >= start]:
+                del self.line_hashes[stale]
+            self.nb_lines = nb_lines
+            self.highlight_all(start)
         self.highlight(line)
         self.dirty = True
         
     def set_text(self, text):
         self.delete('1.0', 'end')
         self.insert('1.0', text)
+        self.line_hashes = {}
+        self.nb_lines = self.line_count()
         self.highlight_all()
 
     def get_text(self):
         return self.get('1.0', 'end')
     
 class Console(tk.Frame):
+    # lines of scrollback kept, older output is dropped
+    max_lines = 1000
+    # flush interval in ms, backs off while there is no output
+    min_interval = 20
+    max_interval = 320
+
     def __init__(self, master, **conf):
         tk.Frame.__init__(self, master, **conf)
         self.read_queue = queue.Queue()
-        self.write_queue = queue.Queue()
+        # chunks written by the interpreter thread since the last flush
+        self.pending = []
+        self.lock = threading.Lock()
+        self.lines = collections.deque([''], maxlen=self.max_lines)
+        self.interval = self.min_interval
         self.textvar = tk.StringVar()
         
         self.label = tk.Label(self, fg='white', bg='black', height=10, anchor='sw', justify='left', font=('Courier', 12))
@@ -71,23 +135,39 @@ class Console(tk.Frame):
         return self.read_queue.get()
     
     def write(self, text):
-        self.write_queue.put(text)
+        with self.lock:
+            self.pending.append(text)
+
+    def writelines(self, texts):
+        with self.lock:
+            self.pending.extend(texts)
+
+    def flush(self):
+        '''move the pending output to the scrollback and update the label once.
+        returns False if there was nothing to show.'''
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return False
+        parts = ''.join(pending).split('\n')
+        self.lines[-1] += parts[0]
+        self.lines.extend(parts[1:])
+        self.label['text'] = '\n'.join(self.lines)
+        return True
         
     def check_queue(self):
-        while True:
-            try:
-                text = self.write_queue.get_nowait()
-            except queue.Empty:
-                break
-            else:
-                self.label['text'] += text
-        self.after(20, self.check_queue)
+        if self.flush():
+            self.interval = self.min_interval
+        else:
+            self.interval = min(2 * self.interval, self.max_interval)
+        self.after(self.interval, self.check_queue)
             
     def on_return(self, event):
         text = self.textvar.get()+'\n'
-        self.write_queue.put(text)
+        self.write(text)
         self.read_queue.put(text)
         self.textvar.set('')
+        self.interval = self.min_interval
         
     def clear(self):
         try:
@@ -95,11 +175,10 @@ class Console(tk.Frame):
                 self.read_queue.get_nowait()
         except queue.Empty:
             pass
-        try:
-            while True:
-                self.write_queue.get_nowait()
-        except queue.Empty:
-            pass
+        with self.lock:
+            self.pending = []
+        self.lines.clear()
+        self.lines.append('')
         self.label['text'] = ''
         self.textvar.set('')
                 
@@ -209,7 +288,7 @@ class IDE:
     def on_run_program(self):
         ast = parser.parse(self.editor.get_text().splitlines())
         self.console.clear()
-        interp = ast_interpreter.ASTInterpreter(ast, self.console.write, self.console.read)
+        interp = ast_interpreter.ClosureInterpreter(ast, self.console.write, self.console.read)
         threading.Thread(target=interp.execute).start()    
         
 def main():
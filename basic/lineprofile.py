@@ -0,0 +1,49 @@
+'''execution count and time per BASIC line, shared by the profiling modes
+of the executors'''
+
+import sys
+import time
+
+def code_lines(labels):
+    '''the BASIC line number of every statement index of an ASTContext.
+
+    lines without code (DIM) share the index of the next line with code,
+    the statement belongs to the last of them.'''
+    lines = {}
+    for lineno, index in sorted(labels.items()):
+        lines[index] = lineno
+    return lines
+
+class LineProfile:
+    '''counts how often every line is entered and the time until the next
+    line is entered'''
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.counts = {}
+        self.times = {}
+        self.line = None
+        self.start = None
+
+    def enter(self, line):
+        now = self.timer()
+        if self.line is not None:
+            self.times[self.line] = self.times.get(self.line, 0.0) + now - self.start
+        self.counts[line] = self.counts.get(line, 0) + 1
+        self.line = line
+        self.start = now
+
+    def stop(self):
+        '''account the time of the line being executed'''
+        if self.line is not None:
+            now = self.timer()
+            self.times[self.line] = self.times.get(self.line, 0.0) + now - self.start
+            self.line = None
+
+    def report(self, out=sys.stderr, limit=None):
+        '''print the lines sorted hottest first'''
+        total = sum(self.times.values()) or 1.0
+        lines = sorted(self.counts, key=lambda line: (-self.times.get(line, 0.0), line))
+        out.write('%8s %10s %10s %6s\n' % ('line', 'count', 'time', '%'))
+        for line in lines[:limit]:
+            elapsed = self.times.get(line, 0.0)
+            out.write('%8d %10d %10.4f %6.1f\n' % (line, self.counts[line], elapsed, 100 * elapsed / total))
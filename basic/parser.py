@@ -1,5 +1,22 @@
 import scanner
 
+# operator precedence for the shunting yard in expr()
+PRECEDENCE = {'+':1, '-':1,
+              '*':2, '/':2,
+              '=':3,
+              '(':4,}
+
+# (left type, operator, right type) -> (result type, typed operation)
+OPERATIONS = {('int', '+', 'int'): ('int', 'add_int'),
+              ('int', '-', 'int'): ('int', 'sub_int'),
+              ('int', '*', 'int'): ('int', 'mul_int'),
+              ('int', '/', 'int'): ('int', 'div_int'),
+              ('str', '+', 'str'): ('str', 'cat_str'),
+              ('int', '=', 'int'): ('int', 'eq_int'),
+              ('str', '=', 'str'): ('int', 'eq_str')}
+
+EXPR_END = frozenset((';', 'THEN', 'end_of_line'))
+
 class ASTContext:
     def __init__(self):
         self.symbols = {}
@@ -10,34 +27,72 @@ class ASTContext:
         self.labels = {}
         self.const_int = []
         self.const_str = []
+        # value -> position in const_int / const_str
+        self.const_index = {'int': {}, 'str': {}}
 
     def add_const(self, typ, val):
-        array = {'int': self.const_int,
-                 'str': self.const_str}[typ]
-        if val in array:
-            return array.index(val)
-        else:
+        index = self.const_index[typ]
+        try:
+            return index[val]
+        except KeyError:
+            array = {'int': self.const_int,
+                     'str': self.const_str}[typ]
             array.append(val)
-            return len(array) -1   
+            index[val] = len(array) - 1
+            return len(array) - 1
+
+class TokenStream:
+    '''the tokens of a program without whitespace, read one at a time.
+
+    current is the token under the cursor. advance() never moves past
+    end_of_line, so reading beyond the end of a line keeps returning it;
+    next_line() moves on to the first token of the next line.'''
+    def __init__(self, tokens):
+        self._next = iter(tokens).next
+        self.current = scanner.Token('end_of_line', 0, 0, '\n')
+
+    def advance(self):
+        '''move to the next token and return the one that was current'''
+        token = self.current
+        if token.type != 'end_of_line':
+            self.current = self._next()
+        return token
+
+    def next_line(self):
+        '''skip the rest of the current line. returns False at the end of the program'''
+        while self.current.type != 'end_of_line':
+            self.current = self._next()
+        try:
+            self.current = self._next()
+        except StopIteration:
+            return False
+        return True
+
+    def remaining(self):
+        '''the texts of the current and all following tokens on the line'''
+        texts = [self.current.text]
+        while self.current.type != 'end_of_line':
+            self.advance()
+            texts.append(self.current.text)
+        return texts
 
 def parse(lines):
     context = ASTContext()
 
     lastno = 0
     
-    for line in lines:
-        if not line.endswith('\n'):
-            line += '\n'
-        tokens = [t for t in scanner.scan(line) if t.type != 'whitespace']
-        if tokens[0].type == 'end_of_line':
+    source = ''.join(line if line.endswith('\n') else line + '\n' for line in lines)
+    tokens = TokenStream(scanner.scan(source, skip_whitespace=True))
+    while tokens.next_line():
+        if tokens.current.type == 'end_of_line':
             continue
-        if tokens[0].type != 'integer':
+        if tokens.current.type != 'integer':
             error('line must start with an integer line number')
-        lineno = int(tokens[0].text)
+        lineno = int(tokens.advance().text)
         if lineno <= lastno:
             error('line numbers not strictly increasing: %d follows %d' % (lineno, lastno))
         context.labels[lineno] = len(context.code)
-        statement = stmt(tokens[1:], lineno, context)
+        statement = stmt(tokens, lineno, context)
         if statement:
             context.code.append(statement)
         lastno = lineno
@@ -48,113 +103,107 @@ def error(msg):
     raise Exception(msg)
 
 def stmt(tokens, lineno, context):
-    if tokens[0].type == 'DIM':
-        if tokens[1].type != 'identifier':
+    keyword = tokens.advance()
+    if keyword.type == 'DIM':
+        name = tokens.advance()
+        if name.type != 'identifier':
             error('line %d identifier expected' % (lineno, ))
-        if tokens[2].type != 'AS':
+        if tokens.advance().type != 'AS':
             error('line %d "AS" expected' % (lineno, ))
-        if tokens[3].type == 'INTEGER':
+        v_type = tokens.advance()
+        if v_type.type == 'INTEGER':
             v_id = context.nb_int
             context.nb_int += 1
             v_type = 'int'
-        elif tokens[3].type == 'STRING':
+        elif v_type.type == 'STRING':
             v_id = context.nb_str
             context.nb_str += 1
             v_type = 'str'
         else:
-            error('line %d: unknown type %s' %( lineno, tokens[3]))
-        if tokens[4].type != 'end_of_line':
+            error('line %d: unknown type %s' %( lineno, v_type))
+        if tokens.current.type != 'end_of_line':
             error('expecting end of line')
-        context.symbols[tokens[1].text] = v_type, v_id
+        context.symbols[name.text] = v_type, v_id
         return ()
 
-    elif tokens[0].type == 'INPUT':
-        expression, t = expr(tokens, 1, lineno, context)
-        if tokens[t].type != ';':
+    elif keyword.type == 'INPUT':
+        expression = expr(tokens, lineno, context)
+        if tokens.advance().type != ';':
             error('INPUT expecting ; after message')
-        if tokens[t+1].type != 'identifier':
+        name = tokens.advance()
+        if name.type != 'identifier':
             error('INPUT expecting variable name after ";"')
-        if tokens[t+1].text not in context.symbols:
-            error('Undefined variable %r for INPUT' % tokens[t+1].text)
-        if tokens[t+2].type != 'end_of_line':
+        if name.text not in context.symbols:
+            error('Undefined variable %r for INPUT' % name.text)
+        if tokens.current.type != 'end_of_line':
             error('expecting end of line')
-        v_type, v_id = context.symbols[tokens[t+1].text]
+        v_type, v_id = context.symbols[name.text]
         return ('input', expression, v_type, v_id)
 
-    elif tokens[0].type == 'IF':
-        cond, t = expr(tokens, 1, lineno, context)
-        if tokens[t].type != 'THEN':
+    elif keyword.type == 'IF':
+        cond = expr(tokens, lineno, context)
+        if tokens.advance().type != 'THEN':
             error('IF expecting THEN after the condition expression')
-        return ('if', cond, stmt(tokens[t+1:], lineno, context))
+        return ('if', cond, stmt(tokens, lineno, context))
 
-    elif tokens[0].type == 'PRINT':
+    elif keyword.type == 'PRINT':
         result = ['print']
-        pos = 1
         while True:
-            expression, pos = expr(tokens, pos, lineno, context)
-            result.append(expression)
-            if tokens[pos].type == ';':
-                pos += 1
-            elif tokens[pos].type == 'end_of_line':
+            result.append(expr(tokens, lineno, context))
+            if tokens.current.type == ';':
+                tokens.advance()
+            elif tokens.current.type == 'end_of_line':
                 break
             else:
                 error('PRINT expecting expressions separated by ";"')
         return tuple(result)
 
-    elif tokens[0].type == 'GOTO':
-        if tokens[1].type != 'integer':
+    elif keyword.type == 'GOTO':
+        target = tokens.advance()
+        if target.type != 'integer':
             error('GOTO: expecting integer line number.')
-        if tokens[2].type != 'end_of_line':
+        if tokens.current.type != 'end_of_line':
             error('expecting end of line')
-        return ('goto', int(tokens[1].text))
+        return ('goto', int(target.text))
 
-    elif tokens[0].type == 'END':
+    elif keyword.type == 'END':
         return ('end',)
 
-    elif tokens[0].type == 'LET':
-        if tokens[1].type != 'identifier':
+    elif keyword.type == 'LET':
+        name = tokens.advance()
+        if name.type != 'identifier':
             error('LET expecting a variable name')
-        if tokens[1].text not in context.symbols:
-            error('Assigning to undefined variable %r' % tokens[1].text)
-        v_type, v_id = context.symbols[tokens[1].text]
-        if tokens[2].type != 'operator' or tokens[2].text != '=':
+        if name.text not in context.symbols:
+            error('Assigning to undefined variable %r' % name.text)
+        v_type, v_id = context.symbols[name.text]
+        equals = tokens.advance()
+        if equals.type != 'operator' or equals.text != '=':
             error('LET expected = sign for assignment')
-        expression, pos = expr(tokens, 3, lineno, context)
-        if tokens[pos].type != 'end_of_line':
+        expression = expr(tokens, lineno, context)
+        if tokens.current.type != 'end_of_line':
             error('expecting end of line')
         return ('assign', v_type, v_id, expression)
 
     else:
-        error('unrecognized statement %s on line %d' % (' '.join(t.text for t in tokens), lineno))
+        error('unrecognized statement %s on line %d' % (' '.join([keyword.text] + tokens.remaining()), lineno))
+
+def operation(op, a, b, lineno):
+    type_a = a[1]
+    type_b = b[1]
+    type_r, typed_op = OPERATIONS.get((type_a, op, type_b), (None, None))
+    if type_r is None:
+        error('invalid use of operator types %s %s %s on line %d' % (type_a, op, type_b, lineno))
+    else:
+        return (typed_op, type_r, a, b)
 
-def expr(tokens, position, lineno, context):
+def expr(tokens, lineno, context):
+    '''parse an expression up to (not including) ;, THEN or the end of line'''
     symbols = context.symbols
     result = []
     stack = []
 
-    op = {'+':1, '-':1,
-          '*':2, '/':2,
-          '=':3,
-          '(':4,}
-
-    def operation(op, a, b):
-        type_a = a[1]
-        type_b = b[1]
-        ops = {('int', '+', 'int'): ('int', 'add_int'),
-               ('int', '-', 'int'): ('int', 'sub_int'),
-               ('int', '*', 'int'): ('int', 'mul_int'),
-               ('int', '/', 'int'): ('int', 'div_int'),
-               ('str', '+', 'str'): ('str', 'cat_str'),
-               ('int', '=', 'int'): ('int', 'eq_int'),
-               ('str', '=', 'str'): ('int', 'eq_str')}
-        type_r, typed_op = ops.get((type_a, op, type_b), (None, None))
-        if type_r is None:
-            error('invalid use of operator types %s %s %s on line %d' % (type_a, op, type_b, lineno))
-        else:
-            return (typed_op, type_r, a, b)
-
-    while tokens[position].type not in (';', 'THEN', 'end_of_line'):
-        t = tokens[position]
+    while tokens.current.type not in EXPR_END:
+        t = tokens.advance()
         if t.type == 'integer':
             result.append(('cst', 'int', context.add_const('int', int(t.text))))
         elif t.type == 'string':
@@ -167,12 +216,12 @@ def expr(tokens, position, lineno, context):
                 error('Undefined variable %r' % t.text)
             result.append(('var', v_type, v_id))
         elif t.type == 'operator':
-            while stack and op[stack[-1]] > op[t.text]:
+            while stack and PRECEDENCE[stack[-1]] > PRECEDENCE[t.text]:
                 s = stack.pop()
                 b = result.pop()
                 a = result.pop()
                 
-                result.append(operation(s, a, b))
+                result.append(operation(s, a, b, lineno))
             stack.append(t.text)
         elif t.type == '(':
             stack.append('(')
@@ -181,20 +230,18 @@ def expr(tokens, position, lineno, context):
             while s != '(':
                 b = result.pop()
                 a = result.pop()
-                result.append(operation(s, a, b))
+                result.append(operation(s, a, b, lineno))
                 s = stack.pop()
         else:
             error('invalid token in expression %r' % t.text)
-        position = position + 1
         
     while stack:
         s = stack.pop()
         b = result.pop()
         a = result.pop()
-        result.append(operation(s, a, b))
+        result.append(operation(s, a, b, lineno))
 
     if len(result) != 1:
         error('incomplete expression')
 
-    return result.pop(), position
-
+    return result.pop()
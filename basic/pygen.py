@@ -0,0 +1,188 @@
+'''This module translates the AST into a Python module.
+
+integer and string variables become local variables of a function run(write, read).
+the program is split into blocks at every line that is the target of a GOTO,
+control flow between the blocks is a dispatch loop:
+
+    while True:
+        if block <= 0:
+            ...
+        if block <= 1:
+            ...
+            block = 0; continue     # GOTO
+
+entering block k runs it and falls through into block k+1 like the BASIC lines do.
+integer division calls div_int, which load_code provides: tac.div_int, truncating
+towards zero like the other executors.
+'''
+
+import sys
+import os
+import imp
+import marshal
+import hashlib
+import struct
+import time
+import parser
+import astopt
+import basicio
+import tac
+
+# bump when the generated code changes so that cached modules are rebuilt
+GENERATOR_VERSION = 3
+
+operators = {
+    'add_int': '(%s + %s)',
+    'sub_int': '(%s - %s)',
+    'mul_int': '(%s * %s)',
+    'div_int': 'div_int(%s, %s)',
+    'eq_int': 'int(%s == %s)',
+    'eq_str': 'int(%s == %s)',
+    'cat_str': '(%s + %s)'}
+
+class PyModule:
+    @classmethod
+    def from_ast(cls, ast_context):
+        self = cls()
+        self.const_int = ast_context.const_int
+        self.const_str = ast_context.const_str
+        self.lines = []
+
+        targets = set()
+        for instr in ast_context.code:
+            while instr[0] == 'if':
+                instr = instr[2]
+            if instr[0] == 'goto':
+                targets.add(ast_context.labels[instr[1]])
+        starts = sorted(targets | {0})
+        self.blocks = {ip: block for block, ip in enumerate(starts)}
+
+        self.emit(0, 'def run(write, read):')
+        for i in xrange(ast_context.nb_int):
+            self.emit(1, 'i%d = 0' % i)
+        for i in xrange(ast_context.nb_str):
+            self.emit(1, 's%d = %r' % (i, ''))
+        self.emit(1, 'block = 0')
+        self.emit(1, 'while True:')
+        for ip, instr in enumerate(ast_context.code):
+            if ip in self.blocks:
+                self.emit(2, 'if block <= %d:' % self.blocks[ip])
+            self.translate_instr(instr, 3, ast_context.labels)
+        self.emit(2, 'return')
+        self.source = '\n'.join(self.lines) + '\n'
+        del self.lines
+        return self
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def translate_expr(self, expr):
+        if expr[0] in operators:
+            return operators[expr[0]] % (self.translate_expr(expr[2]), self.translate_expr(expr[3]))
+        elif expr[0] == 'var':
+            return '%s%d' % (expr[1][0], expr[2])
+        elif expr[0] == 'cst':
+            if expr[1] == 'int':
+                return repr(self.const_int[expr[2]])
+            else:
+                return repr(self.const_str[expr[2]])
+        else:
+            assert False, expr
+
+    def translate_str(self, expr):
+        if expr[1] == 'int':
+            return 'str(%s)' % self.translate_expr(expr)
+        else:
+            return self.translate_expr(expr)
+
+    def translate_instr(self, instr, indent, labels):
+        if instr[0] == 'input':
+            self.emit(indent, 'write(%s)' % self.translate_str(instr[1]))
+            if instr[2] == 'int':
+                self.emit(indent, 'i%d = int(read().rstrip(%r))' % (instr[3], '\n'))
+            else:
+                self.emit(indent, 's%d = read().rstrip(%r)' % (instr[3], '\n'))
+        elif instr[0] == 'assign':
+            self.emit(indent, '%s%d = %s' % (instr[1][0], instr[2], self.translate_expr(instr[3])))
+        elif instr[0] == 'if':
+            cond = instr[1]
+            if cond[0] in ('eq_int', 'eq_str'):
+                # no need to convert the comparison to an integer here
+                test = '%s == %s' % (self.translate_expr(cond[2]), self.translate_expr(cond[3]))
+            else:
+                test = self.translate_expr(cond)
+            self.emit(indent, 'if %s:' % test)
+            self.translate_instr(instr[2], indent + 1, labels)
+        elif instr[0] == 'goto':
+            self.emit(indent, 'block = %d' % self.blocks[labels[instr[1]]])
+            self.emit(indent, 'continue')
+        elif instr[0] == 'print':
+            parts = [self.translate_str(ex) for ex in instr[1:]]
+            self.emit(indent, 'write(%s)' % ' + '.join(parts + [repr('\n')]))
+        elif instr[0] == 'end':
+            self.emit(indent, 'return')
+        else:
+            assert False, instr
+
+    def compile(self, filename='<basic>'):
+        return compile(self.source, filename, 'exec')
+
+
+def load_code(code):
+    namespace = {'div_int': tac.div_int}
+    exec code in namespace
+    return namespace['run']
+
+def compile_file(fname, cache_dir=None):
+    '''return the run function of the BASIC program in file fname.
+
+    the compiled module is cached as a .pyc in cache_dir (by default a
+    directory __basic_cache__ next to the program) named by the hash of the
+    BASIC source, so unchanged programs are neither parsed nor compiled again.'''
+    with open(fname, 'r') as infile:
+        source = infile.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(fname)), '__basic_cache__')
+    key = hashlib.sha1('%d\0%s' % (GENERATOR_VERSION, source)).hexdigest()
+    cache_file = os.path.join(cache_dir, key + '.pyc')
+
+    try:
+        with open(cache_file, 'rb') as infile:
+            if infile.read(4) == imp.get_magic():
+                infile.read(4)
+                return load_code(marshal.load(infile))
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+
+    ast_ctx = parser.parse(source.splitlines())
+    astopt.optimize(ast_ctx)
+    code = PyModule.from_ast(ast_ctx).compile(fname)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'wb') as outfile:
+            outfile.write(imp.get_magic())
+            outfile.write(struct.pack('<L', int(time.time()) & 0xffffffff))
+            marshal.dump(code, outfile)
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError):
+        pass
+    return load_code(code)
+
+def main(fname):
+    run = compile_file(fname)
+    output, reader = basicio.standard_io()
+    try:
+        run(output.write, reader.readline)
+    finally:
+        output.close()
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--source':
+        with open(sys.argv[2], 'r') as infile:
+            ast_ctx = parser.parse(infile)
+        astopt.optimize(ast_ctx)
+        sys.stdout.write(PyModule.from_ast(ast_ctx).source)
+    else:
+        main(sys.argv[1])
@@ -1,103 +1,68 @@
+import re
 from collections import namedtuple
 
 keywords = ['DIM', 'AS', 'INTEGER', 'STRING', 'INPUT', 'IF', 'THEN', 'GOTO', 'PRINT', 'END', 'FLOAT', 'LET']
 
 Token = namedtuple('Token', 'type, start, end, text')
 
-def scan(source):
-    pos = 0
-    while pos < len(source):
-        token = anytoken(pos, source)
-        yield token
-        pos = token.end
+# the alternatives are tried in order at every position, the first match
+# decides the token. the last one matches any character, so every position
+# starts a token and finditer covers the whole source without gaps.
+TOKEN_PATTERNS = [
+    ('exponent', r'(?:[0-9]+\.?[0-9]*|\.[0-9]+)E[+-]?[0-9]+'),
+    ('bad_exponent', r'(?:[0-9]+\.?[0-9]*|\.[0-9]+)E[+-]?'),
+    ('decimal', r'[0-9]+\.[0-9]*|\.[0-9]+'),
+    ('integer', r'[0-9]+'),
+    ('bad_decimal_point', r'\.'),
+    ('keyword', r'(?:%s)(?![A-Z_0-9])' % '|'.join(keywords)),
+    ('identifier', r'[A-Z_][A-Z_0-9]*'),
+    ('string', r'"(?:[^"\n]|"")*"(?!")'),
+    ('bad_string', r'"(?:[^"\n]|"")*'),
+    ('end_of_line', r'\n'),
+    ('whitespace', r'[ \t]+'),
+    ('operator', r'[-+*/=<>]'),
+    ('punctuation', r'[();:]'),
+    ('illegal', r'[\s\S]'),
+]
 
-def anytoken(pos, source):
-    if source[pos] in '0123456789':
-        return number(pos, pos+1, source)
-    elif source[pos] == '.':
-        return decimal_point(pos, pos+1, source)
-    elif source[pos] in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ_':
-        return identifier_or_keyword(pos, pos+1, source)
-    elif source[pos] == '"':
-        return string(pos, pos+1, source)
-    elif source[pos] == '\n':
-        return Token('end_of_line', pos, pos+1, '\n')
-    elif source[pos] in ' \t':
-        return whitespace(pos, pos+1, source)
-    elif source[pos] in '+-*/=<>':
-        return Token('operator', pos, pos+1, source[pos])
-    elif source[pos] in '();:':
-        return Token(source[pos], pos, pos+1, source[pos])
-    else:
-        return Token('error', pos, pos+1, 'illegal character')
-        
-def number(start, pos, source):
-    while source[pos] in '0123456789':
-        pos += 1
-    if source[pos] == '.':
-        return decimal_number(start, pos+1, source)
-    elif source[pos] == 'E':
-        return e_number(start, pos+1, source)
-    else:
-        return Token('integer', start, pos, source[start:pos])
+MASTER = re.compile('|'.join('(?P<%s>%s)' % item for item in TOKEN_PATTERNS))
 
-def decimal_point(start, pos, source):
-    if source[pos] in '0123456789':
-        return decimal_number(start, pos+1, source)
-    else:
-        return Token('error', start, pos, 'unexpected decimal point (not part of a number)')
+# alternative -> token type, None if the type is the token text
+TYPES = dict((name, name) for name, pattern in TOKEN_PATTERNS)
+TYPES.update({'exponent': 'float',
+              'decimal': 'float',
+              'keyword': None,
+              'punctuation': None,
+              'bad_exponent': 'error',
+              'bad_decimal_point': 'error',
+              'bad_string': 'error',
+              'illegal': 'error'})
+
+# error tokens carry the message instead of the source text
+ERRORS = {'bad_exponent': 'illegal number literal',
+          'bad_decimal_point': 'unexpected decimal point (not part of a number)',
+          'bad_string': 'end of line in a string literal',
+          'illegal': 'illegal character'}
+
+def scan(source, skip_whitespace=False):
+    '''tokenize the whole of source (a string or an mmap) in one pass'''
+    new_token = tuple.__new__
+    types = TYPES
+    errors = ERRORS
+    for match in MASTER.finditer(source):
+        kind = match.lastgroup
+        if skip_whitespace and kind == 'whitespace':
+            continue
+        start, end = match.span()
+        text = match.group()
+        yield new_token(Token, (types[kind] or text, start, end, errors.get(kind, text)))
+
+def anytoken(pos, source):
+    match = MASTER.match(source, pos)
+    kind = match.lastgroup
+    text = match.group()
+    return Token(TYPES[kind] or text, match.start(), match.end(), ERRORS.get(kind, text))
 
-def decimal_number(start, pos, source):
-    while source[pos] in '0123456789':
-        pos += 1
-    if source[pos] == 'E':
-        return e_number(start, pos+1, source)
-    else:
-        return Token('float', start, pos, source[start:pos])
-    
-def e_number(start, pos, source):
-    if source[pos] in '+-':
-        pos += 1
-    # not an elif, formally we change to state e_number_after_sign
-    if source[pos] in '0123456789':
-        return exponent_number(start, pos+1, source)
-    else:
-        return Token('error', start, pos, 'illegal number literal')
-    
-def exponent_number(start, pos, source):
-    while source[pos] in '0123456789':
-        pos += 1
-    return Token('float', start, pos, source[start:pos])
-        
-def identifier_or_keyword(start, pos, source):
-    while source[pos] in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ_0123456789':
-        pos += 1
-    if source[start:pos] in keywords:
-        return Token(source[start:pos], start, pos, source[start:pos])
-    else:
-        return Token('identifier', start, pos, source[start:pos])
-    
-def string(start, pos, source):
-    while source[pos] not in '\n"':
-        pos += 1
-    if source[pos] == '\n':
-        return Token('error', start, pos, 'end of line in a string literal')
-    elif source[pos] == '"':
-        return string_quote(start, pos+1, source)
-    else:
-        assert False, 'impossible to reach this point! source[pos] = %r' % source[pos]
-    
-def string_quote(start, pos, source):
-    if source[pos] == '"':
-        return string(start, pos+1, source)
-    else:
-        return Token('string', start, pos, source[start:pos])
-    
-def whitespace(start, pos, source):
-    while source[pos] in ' \t':
-        pos += 1
-    return Token('whitespace', start, pos, source[start:pos])
-    
 def test_numbers():
     token = anytoken(0, '1\n')
     assert token.type == 'integer'
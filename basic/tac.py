@@ -12,10 +12,53 @@ operations = {
     'eq_str',
     'cat_str'}
 
+commutative = {'add_int', 'mul_int', 'eq_int', 'eq_str'}
+
+# library functions without side effects, calls can be folded or removed
+pure_libcalls = {'cat_str', 'eq_str'}
+
+def div_int(a, b):
+    '''integer division truncating towards zero like the C runtime'''
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+fold = {
+    'add_int': lambda a, b: a + b,
+    'sub_int': lambda a, b: a - b,
+    'mul_int': lambda a, b: a * b,
+    'div_int': div_int,
+    'eq_int': lambda a, b: int(a == b),
+    'eq_str': lambda a, b: int(a == b),
+    'cat_str': lambda a, b: a + b}
+
+def is_temp(sym):
+    return sym is not None and sym.startswith('tmp')
+
+def basic_blocks(code):
+    '''split TAC code into basic blocks.
+
+    a block begins at a label that is the target of a jump, or after a jump
+    or end instruction. labels of lines nothing jumps to do not split blocks.'''
+    targets = {line[1] for line in code if line[0] in ('jmp', 'jmpz', 'jmpT')}
+    blocks = []
+    block = []
+    for line in code:
+        if line[0] == 'label' and line[1] in targets and block:
+            blocks.append(block)
+            block = []
+        block.append(line)
+        if line[0] in ('jmp', 'jmpz', 'jmpT', 'end'):
+            blocks.append(block)
+            block = []
+    if block:
+        blocks.append(block)
+    return blocks
+
 class TAC:
     def __init__(self):
         self.code = []
         self.consts = {}
+        self.variables = {}
         self.gen_temp_symbol = ('tmp%d' % i for i in itertools.count(1))
         self.gen_const_symbol = ('const%d' % i for i in itertools.count(1))
         self.gen_label = ('label%d' % i for i in itertools.count(1))
@@ -27,15 +70,137 @@ class TAC:
         self.consts.update(('const_int_%d' % i, v) for i,v in enumerate(ast_context.const_int))
         self.consts.update(('const_str_%d' % i, v) for i,v in enumerate(ast_context.const_str))
         self.consts['newline'] = "\n"
+        self.variables.update(('var_int_%d' % i, 0) for i in xrange(ast_context.nb_int))
+        self.variables.update(('var_str_%d' % i, '') for i in xrange(ast_context.nb_str))
 
-        lines = {value:key for key,value in ast_context.labels.items()}
+        # several line numbers share an index when lines produce no code
+        lines = {}
+        for lineno, index in sorted(ast_context.labels.items()):
+            lines.setdefault(index, []).append(lineno)
 
         for ln, instr in enumerate(ast_context.code):
-            if ln in lines:
-                self.code.append(('label', 'line%d' % lines[ln]))
+            for lineno in lines.get(ln, ()):
+                self.code.append(('label', 'line%d' % lineno))
             self.translate_instr(instr)
         return self
     
+    def optimize(self):
+        '''optimize the code in place and return the number of removed instructions.
+
+        constant propagation and folding, copy propagation and common
+        subexpression elimination are done within each basic block, dead
+        temporaries are then removed from the whole program. temporaries
+        are assigned only once, so their uses can be counted globally.'''
+        before = len(self.code)
+        # (type, value) -> name of the constants, for const_symbol
+        self.const_names = dict(((type(value), value), name) for name, value in self.consts.items())
+        while True:
+            length = len(self.code)
+            self.code = [line for block in basic_blocks(self.code)
+                         for line in self.optimize_block(block)]
+            self.remove_dead_temps()
+            if len(self.code) == length:
+                break
+        return before - len(self.code)
+
+    def const_symbol(self, value):
+        '''the name of a constant with the given value, adding it if needed'''
+        key = (type(value), value)
+        if key not in self.const_names:
+            name = next(self.gen_const_symbol)
+            self.consts[name] = value
+            self.const_names[key] = name
+        return self.const_names[key]
+
+    def optimize_block(self, block):
+        copies = {}     # symbol -> symbol holding the same value
+        available = {}  # (op, a, b) -> symbol holding the result
+        result = []
+
+        def value(sym):
+            return copies.get(sym, sym)
+
+        def define(sym):
+            # sym gets a new value, forget everything that depends on it
+            for key, val in copies.items():
+                if key == sym or val == sym:
+                    del copies[key]
+            for key, val in available.items():
+                if val == sym or sym in key[1:]:
+                    del available[key]
+
+        def assign(dst, src):
+            define(dst)
+            if dst != src:
+                copies[dst] = src
+                result.append(('mov', dst, src))
+
+        for line in block:
+            if line[0] in operations or (line[0] == 'libcall' and line[3] in pure_libcalls):
+                if line[0] == 'libcall':
+                    op, dst, a, b = line[3], line[2], value(line[4]), value(line[5])
+                else:
+                    op, dst, a, b = line[0], line[1], value(line[2]), value(line[3])
+                if op in commutative and b < a:
+                    a, b = b, a
+                # a division by zero is left to run time, the line may never run
+                if a in self.consts and b in self.consts and not (op == 'div_int' and self.consts[b] == 0):
+                    assign(dst, self.const_symbol(fold[op](self.consts[a], self.consts[b])))
+                elif (op, a, b) in available:
+                    assign(dst, available[op, a, b])
+                else:
+                    define(dst)
+                    if line[0] == 'libcall':
+                        result.append(('libcall', 2, dst, op, a, b))
+                    else:
+                        result.append((op, dst, a, b))
+                    if dst not in (a, b):
+                        available[op, a, b] = dst
+            elif line[0] == 'mov':
+                assign(line[1], value(line[2]))
+            elif line[0] == 'libcall':
+                args = tuple(value(arg) for arg in line[4:])
+                if line[2] is not None:
+                    define(line[2])
+                result.append(line[:4] + args)
+            elif line[0] in ('jmpz', 'jmpT'):
+                cond = value(line[2])
+                if cond in self.consts:
+                    if bool(self.consts[cond]) == (line[0] == 'jmpT'):
+                        result.append(('jmp', line[1]))
+                else:
+                    result.append((line[0], line[1], cond))
+            else:
+                result.append(line)
+        return result
+
+    def remove_dead_temps(self):
+        while True:
+            used = set()
+            for line in self.code:
+                if line[0] == 'libcall':
+                    used.update(line[4:])
+                elif line[0] in operations:
+                    used.update(line[2:])
+                elif line[0] == 'mov':
+                    used.add(line[2])
+                elif line[0] in ('jmpz', 'jmpT'):
+                    used.add(line[2])
+
+            def dead(line):
+                if line[0] in operations or line[0] == 'mov':
+                    dst = line[1]
+                elif line[0] == 'libcall' and line[3] in pure_libcalls:
+                    dst = line[2]
+                else:
+                    return False
+                return is_temp(dst) and dst not in used
+
+            code = [line for line in self.code if not dead(line)]
+            if len(code) == len(self.code):
+                return
+            self.code = code
+
     def dump(self):
         for name, value in self.consts.items():
             print '%s = %r' % (name, value)
@@ -50,7 +215,11 @@ class TAC:
             self.code.append(('libcall', 1, None, 'print' + instr[1][1][0], prompt))
             self.code.append(('libcall', 0, 'var_%s_%d' % (instr[2], instr[3]), 'input' + instr[2][0]))
         elif instr[0] == 'assign':
-            self.translate_expr(instr[3], 'var_%s_%d' % (instr[1], instr[2]))
+            target = 'var_%s_%d' % (instr[1], instr[2])
+            result = self.translate_expr(instr[3], target)
+            if result != target:
+                # plain variables and constants are not computed into the target
+                self.code.append(('mov', target, result))
         elif instr[0] == 'if':
             cond = self.translate_expr(instr[1])
             endif = next(self.gen_label)
@@ -92,22 +261,52 @@ class TAC:
         else:
             assert False, expr
 
-    def interpreter(self):
-        '''an interpreter for the TAC'''
+    def interpreter(self, profile=None, write=None, read=None):
+        '''an interpreter for the TAC.
+
+        profile, a lineprofile.LineProfile, is told about every BASIC line
+        that starts executing, found by the line labels of fromast. the
+        profiled run executes a copy of the code in which these labels are
+        replaced by 'line' instructions, the unprofiled loop never sees them.
+        the output goes to write and the INPUT lines come from read, by
+        default sys.stdout.write and sys.stdin.readline.'''
+        if write is None:
+            write = sys.stdout.write
+        if read is None:
+            read = sys.stdin.readline
         labels = { line[1]:index for index, line in enumerate(self.code) if line[0] == 'label' }
+        code = self.code
+        if profile is not None:
+            code = list(code)
+            for index, line in enumerate(self.code):
+                # the labels of lines without code are followed by the label of the next line
+                if line[0] == 'label' and line[1].startswith('line'):
+                    following = self.code[index+1] if index+1 < len(self.code) else ('end',)
+                    if not (following[0] == 'label' and following[1].startswith('line')):
+                        code[index] = ('line', int(line[1][4:]))
+            try:
+                self.run(code, labels, write, read, profile)
+            finally:
+                profile.stop()
+        else:
+            self.run(code, labels, write, read)
+
+    def run(self, code, labels, write, read, profile=None):
+        '''the interpreter loop, profile is only used by 'line' instructions'''
         symbols = dict(self.consts)
+        symbols.update(self.variables)
         pc = 0
         
         lib = {
-            'prints': sys.stdout.write,
-            'printi': lambda i: sys.stdout.write(str(i)),
-            'inputs': raw_input,
-            'inputi': lambda: int(raw_input()),
+            'prints': write,
+            'printi': lambda i: write(str(i)),
+            'inputs': lambda: read().rstrip('\n'),
+            'inputi': lambda: int(read()),
             'cat_str': lambda a,b: a+b,
             'eq_str': lambda a,b: int(a==b)}
         
         while True:
-            line = self.code[pc]
+            line = code[pc]
             #print pc, line, symbols
             pc += 1
             if line[0] == 'libcall':
@@ -117,10 +316,18 @@ class TAC:
                 args = [symbols[x] for x in line[4:4+nb_arg]]
                 ret = lib[libfunc](*args)
                 symbols[ret_var] = ret
+            elif line[0] == 'mov':
+                symbols[line[1]] = symbols[line[2]]
             elif line[0] == 'eq_int':
                 symbols[line[1]] = int(symbols[line[2]] == symbols[line[3]])
+            elif line[0] == 'add_int':
+                symbols[line[1]] = symbols[line[2]] + symbols[line[3]]
             elif line[0] == 'sub_int':
                 symbols[line[1]] = symbols[line[2]] - symbols[line[3]]
+            elif line[0] == 'mul_int':
+                symbols[line[1]] = symbols[line[2]] * symbols[line[3]]
+            elif line[0] == 'div_int':
+                symbols[line[1]] = div_int(symbols[line[2]], symbols[line[3]])
             elif line[0] == 'cat_str':
                 symbols[line[1]] = symbols[line[2]] + symbols[line[3]]
             elif line[0] == 'eq_str':
@@ -137,47 +344,188 @@ class TAC:
                 pc = labels[line[1]]
             elif line[0] == 'label':
                 pass
+            elif line[0] == 'line':
+                profile.enter(line[1])
             else:
                 assert False, line
 
-    def compile(self, asm):
+    def uses_defs(self, line):
+        '''the symbols read and the symbol written by a TAC instruction'''
+        if line[0] == 'libcall':
+            return line[4:4+line[1]], line[2]
+        elif line[0] in operations:
+            return line[2:4], line[1]
+        elif line[0] == 'mov':
+            return line[2:3], line[1]
+        elif line[0] in ('jmpT', 'jmpz'):
+            return line[2:3], None
+        else:
+            return (), None
+
+    def live_intervals(self):
+        '''liveness analysis over the control flow graph.
+
+        returns the live interval (first, last instruction number) of every
+        non-constant symbol and the set of symbols live at program entry.'''
+        blocks = basic_blocks(self.code)
+        block_of_label = {}
+        starts = []
+        pos = 0
+        for b, block in enumerate(blocks):
+            starts.append(pos)
+            pos += len(block)
+            for line in block:
+                if line[0] == 'label':
+                    block_of_label[line[1]] = b
+        starts.append(pos)
+
+        succ = []
+        use = []
+        defs = []
+        for b, block in enumerate(blocks):
+            last = block[-1]
+            if last[0] == 'jmp':
+                succ.append([block_of_label[last[1]]])
+            elif last[0] in ('jmpz', 'jmpT'):
+                succ.append([block_of_label[last[1]], b+1])
+            elif last[0] == 'end':
+                succ.append([])
+            else:
+                succ.append([b+1])
+            succ[-1] = [s for s in succ[-1] if s < len(blocks)]
+            u = set()
+            d = set()
+            for line in block:
+                reads, written = self.uses_defs(line)
+                u.update(x for x in reads if x not in d and x not in self.consts)
+                if written is not None:
+                    d.add(written)
+            use.append(u)
+            defs.append(d)
+
+        live_in = [set() for _ in blocks]
+        live_out = [set() for _ in blocks]
+        changed = True
+        while changed:
+            changed = False
+            for b in reversed(xrange(len(blocks))):
+                out = set()
+                for s in succ[b]:
+                    out |= live_in[s]
+                inp = use[b] | (out - defs[b])
+                if out != live_out[b] or inp != live_in[b]:
+                    live_out[b] = out
+                    live_in[b] = inp
+                    changed = True
+
+        intervals = {}
+        def extend(sym, pos):
+            first, last = intervals.get(sym, (pos, pos))
+            intervals[sym] = (min(first, pos), max(last, pos))
+        for pos, line in enumerate(self.code):
+            reads, written = self.uses_defs(line)
+            for sym in reads:
+                if sym not in self.consts:
+                    extend(sym, pos)
+            if written is not None:
+                extend(written, pos)
+        for b in xrange(len(blocks)):
+            for sym in live_in[b]:
+                extend(sym, starts[b])
+            for sym in live_out[b]:
+                extend(sym, starts[b+1] - 1)
+        return intervals, live_in[0] if blocks else set()
+
+    def allocate(self, intervals, registers):
+        '''linear scan register allocation.
+
+        returns a mapping from symbol to register name and a mapping from the
+        spilled symbols to memory slots. symbols whose intervals do not
+        overlap share a slot.'''
+        location = {}
+        spilled = []
+        active = []  # (end, sym), sorted by end
+        free = list(registers)
+        for sym, (start, end) in sorted(intervals.items(), key=lambda item: (item[1], item[0])):
+            while active and active[0][0] < start:
+                free.append(location[active.pop(0)[1]])
+            if free:
+                location[sym] = free.pop()
+                active.append((end, sym))
+                active.sort()
+            elif active and active[-1][0] > end:
+                # spill the active interval that lives longest
+                last_end, victim = active.pop()
+                location[sym] = location.pop(victim)
+                spilled.append(victim)
+                active.append((end, sym))
+                active.sort()
+            else:
+                spilled.append(sym)
+
+        slots = {}
+        slot_ends = []
+        for sym in sorted(spilled, key=lambda sym: intervals[sym]):
+            start, end = intervals[sym]
+            for slot, slot_end in enumerate(slot_ends):
+                if slot_end < start:
+                    break
+            else:
+                slot = len(slot_ends)
+                slot_ends.append(None)
+            slot_ends[slot] = end
+            slots[sym] = slot
+        return location, slots
+
+    def compile(self, asm, register_allocation=True):
         '''compile the TAC to x86 assemply language.
         
-        the assembly output is written by an ASM class which knows about assembler syntax'''
+        the assembly output is written by an ASM class which knows about assembler syntax.
 
-        symbols = set()
+        with register_allocation the variables and temporaries live in the
+        callee saved registers where possible and spilled symbols share memory
+        slots. without it every symbol gets its own memory location.'''
 
-        for sym, val in self.consts.items():
-            symbols.add(sym)
-    
-        for line in self.code:
-            if line[0] == 'libcall':
-                for arg in line[4:]:
-                    assert arg in symbols
-                if line[2] is not None:
-                    symbols.add(line[2])
-            elif line[0] in operations:
-                assert line[2] in symbols
-                assert line[3] in symbols
-                symbols.add(line[1])
-            elif line[0] == 'end':
-                pass
-            elif line[0] in ('jmpT', 'jmpz'):
-                assert line[2] in symbols
-            elif line[0] == 'jmp':
-                pass
-            elif line[0] == 'label':
-                pass
+        intervals, live_at_entry = self.live_intervals()
+        if register_allocation:
+            location, slots = self.allocate(intervals, asm.allocatable)
+            slot_names = ['slot%d' % i for i in xrange(len(set(slots.values())))]
+        else:
+            location = {}
+            slots = {sym: i for i, sym in enumerate(sorted(intervals))}
+            slot_names = sorted(intervals)
+
+        def operand(sym):
+            if sym in self.consts:
+                if isinstance(self.consts[sym], str):
+                    return asm.imm(asm.local('_const_'+sym))
+                else:
+                    return asm.imm(self.consts[sym])
+            elif sym in location:
+                return asm.reg(location[sym])
             else:
-                assert False, line
-    
+                return asm.local(slot_names[slots[sym]])
+
+        def is_reg(sym):
+            return sym in location
+
+        def move(dst, src):
+            if dst == src:
+                return
+            if is_reg(dst) or is_reg(src) or src in self.consts:
+                asm.mov(operand(dst), operand(src))
+            else:
+                asm.mov(asm.eax, operand(src))
+                asm.mov(operand(dst), asm.eax)
+
         asm.prologue()
         
-    
         asm.extproc('printi')
         asm.extproc('prints')
         asm.extproc('inputi')
         asm.extproc('inputs')
+        asm.extproc('cat_str')
+        asm.extproc('eq_str')
         
         asm.rodata()
         for sym, val in self.consts.items():
@@ -186,61 +534,101 @@ class TAC:
                 asm.bytes([ord(x) for x in val+'\0'])
                 
         asm.data()
-        for sym, val in self.consts.items():
-            if not isinstance(val, str):
-                asm.label(asm.local(sym))
-                asm.dword(val)
-            else:
-                asm.label(asm.local(sym))
-                asm.dword(asm.local('_const_'+sym))
-             
-        for sym in symbols:
-            if sym not in self.consts:
-                asm.label(asm.local(sym))
-                asm.dword(0)
+        for name in slot_names:
+            asm.label(asm.local(name))
+            asm.dword(0)
    
         asm.code()
         asm.label(asm.cname('main'))
+        used_registers = sorted(set(location.values()))
+        for reg in used_registers:
+            asm.push(asm.reg(reg))
+        for sym in live_at_entry:
+            if is_reg(sym):
+                asm.mov(operand(sym), asm.imm(0))
     
-        for line in self.code:
+        fused_jump = None
+        for pos, line in enumerate(self.code):
+            if pos == fused_jump:
+                continue
             if line[0] == 'libcall':
                 nb_arg = line[1]
                 ret_var = line[2]
                 libfunc = line[3]
                 for arg in reversed(line[4:4+nb_arg]):
-                    asm.push(asm.local(arg))
+                    asm.push(operand(arg))
                 asm.call(asm.cname(libfunc))
+                if nb_arg:
+                    asm.add(asm.esp, asm.imm(4 * nb_arg))
                 if ret_var is not None:
-                    asm.mov(asm.local(ret_var), asm.eax)
-                for arg in line[4:4+nb_arg]:
-                    asm.pop(asm.eax)
+                    asm.mov(operand(ret_var), asm.eax)
+            elif line[0] == 'mov':
+                move(line[1], line[2])
+            elif line[0] in ('add_int', 'sub_int', 'mul_int'):
+                dst, a, b = line[1:4]
+                if line[0] in commutative and dst == b:
+                    a, b = b, a
+                op = {'add_int': asm.add, 'sub_int': asm.sub, 'mul_int': asm.imul}[line[0]]
+                if is_reg(dst) and dst != b:
+                    move(dst, a)
+                    op(operand(dst), operand(b))
+                else:
+                    asm.mov(asm.eax, operand(a))
+                    op(asm.eax, operand(b))
+                    asm.mov(operand(dst), asm.eax)
+            elif line[0] == 'div_int':
+                asm.mov(asm.eax, operand(line[2]))
+                divisor = operand(line[3])
+                if line[3] in self.consts:
+                    asm.mov(asm.ecx, divisor)
+                    divisor = asm.ecx
+                asm.cdq()
+                asm.idiv(divisor)
+                asm.mov(operand(line[1]), asm.eax)
             elif line[0] == 'eq_int':
-                asm.mov(asm.eax, asm.local(line[2]))
+                dst, a, b = line[1:4]
+                if a in self.consts:
+                    a, b = b, a
+                following = self.code[pos+1] if pos+1 < len(self.code) else ('end',)
+                if following[0] in ('jmpz', 'jmpT') and following[2] == dst and intervals[dst][1] == pos+1:
+                    # the result is only needed by the conditional jump after it
+                    if is_reg(a):
+                        asm.cmp(operand(a), operand(b))
+                    else:
+                        asm.mov(asm.eax, operand(a))
+                        asm.cmp(asm.eax, operand(b))
+                    if following[0] == 'jmpz':
+                        asm.jne(asm.local(following[1]))
+                    else:
+                        asm.jmpz(asm.local(following[1]))
+                    fused_jump = pos+1
+                    continue
+                asm.mov(asm.eax, operand(a))
                 asm.mov(asm.ecx, asm.imm(0))
-                asm.cmp(asm.eax, asm.local(line[3]))
+                asm.cmp(asm.eax, operand(b))
                 asm.sete(asm.reg('cl')) #cl = 1 if zero_flag else 0
-                asm.mov(asm.local(line[1]), asm.ecx)
-            elif line[0] == 'sub_int':
-                asm.mov(asm.eax, asm.local(line[2]))
-                asm.sub(asm.eax, asm.local(line[3]))
-                asm.mov(asm.local(line[1]), asm.eax)
+                asm.mov(operand(dst), asm.ecx)
             elif line[0] == 'end':
-                pass
-            elif line[0] == 'jmpT':
-                asm.mov(asm.eax, asm.imm(0))
-                asm.cmp(asm.eax, asm.local(line[2]))
-                asm.jne(asm.local(line[1]))
-            elif line[0] == 'jmpz':
-                asm.mov(asm.eax, asm.imm(0))
-                asm.cmp(asm.eax, asm.local(line[2]))
-                asm.jmpz(asm.local(line[1]))
+                asm.jmp(asm.local('_exit'))
+            elif line[0] in ('jmpT', 'jmpz'):
+                if is_reg(line[2]):
+                    asm.test(operand(line[2]), operand(line[2]))
+                else:
+                    asm.mov(asm.eax, operand(line[2]))
+                    asm.test(asm.eax, asm.eax)
+                if line[0] == 'jmpT':
+                    asm.jne(asm.local(line[1]))
+                else:
+                    asm.jmpz(asm.local(line[1]))
             elif line[0] == 'jmp':
                 asm.jmp(asm.local(line[1]))
             elif line[0] == 'label':
                 asm.label(asm.local(line[1]))       
             else:
                 assert False, line
+        asm.label(asm.local('_exit'))
+        for reg in reversed(used_registers):
+            asm.pop(asm.reg(reg))
+        asm.mov(asm.eax, asm.imm(0))
         asm.ret()
         asm.epilogue()
-
-
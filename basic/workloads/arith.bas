@@ -0,0 +1,11 @@
+10 DIM I AS INTEGER
+20 DIM S AS INTEGER
+30 DIM T AS INTEGER
+40 LET I = 100000
+50 LET T = I * 3 / 2 - I
+60 LET S = S + T - I / 4
+70 LET I = I - 1
+80 IF I = 0 THEN GOTO 100
+90 GOTO 50
+100 PRINT "SUM: "; S
+110 END
@@ -0,0 +1,15 @@
+10 DIM I AS INTEGER
+20 DIM N AS INTEGER
+30 DIM M AS INTEGER
+40 DIM K AS INTEGER
+50 DIM S AS INTEGER
+60 LET I = 50000
+70 LET M = 0 - 7
+80 LET K = 0 - 2
+90 LET N = 0 - I
+100 LET S = S + N / 7 + I / M + N / M + M / 2 + 7 / K
+110 LET I = I - 1
+120 IF I = 0 THEN GOTO 140
+130 GOTO 90
+140 PRINT "SUM: "; S; " "; M / 2; " "; 7 / K; " "; N / 3
+150 END
@@ -0,0 +1,13 @@
+10 DIM N AS INTEGER
+20 DIM X AS INTEGER
+30 DIM S AS INTEGER
+40 DIM NAME AS STRING
+50 INPUT "NAME? "; NAME
+60 INPUT "COUNT? "; N
+70 IF N = 0 THEN GOTO 120
+80 INPUT "VALUE? "; X
+90 LET S = S + X
+100 LET N = N - 1
+110 GOTO 70
+120 PRINT "HELLO "; NAME; ", THE TOTAL IS "; S
+130 END
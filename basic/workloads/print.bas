@@ -0,0 +1,9 @@
+10 DIM I AS INTEGER
+20 DIM NAME AS STRING
+30 LET I = 20000
+40 LET NAME = "LINE"
+50 PRINT NAME; " "; I; " OF "; 20000
+60 LET I = I - 1
+70 IF I = 0 THEN GOTO 90
+80 GOTO 50
+90 END
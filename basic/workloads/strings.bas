@@ -0,0 +1,14 @@
+10 DIM I AS INTEGER
+20 DIM N AS INTEGER
+30 DIM T AS STRING
+40 DIM U AS STRING
+50 LET I = 5000
+60 LET T = T + "AB"
+70 LET U = "X" + U
+80 IF T = U THEN GOTO 130
+90 LET I = I - 1
+100 IF I = 0 THEN GOTO 120
+110 GOTO 60
+120 LET N = T = U
+130 PRINT "DONE "; N; " "; U + "!"
+140 END
@@ -40,12 +40,15 @@ def stree(tree):
         return '(' + ' '.join([head] + map(stree, tree[1:])) + ')'
          
 from itertools import count
-label = count(100)              
-def stack_code(ast):
+
+def stack_code(ast, label=None):
+    # label numbers the jump targets, a fresh counter for every top level call
+    if label is None:
+        label = count(100)
     operators = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '%': 'mod', 'and': 'and', 'or': 'or', '==': 'eq'}
     if ast[0] in operators:
-        stack_code(ast[2])
-        stack_code(ast[3])
+        stack_code(ast[2], label)
+        stack_code(ast[3], label)
         print operators[ast[0]]
     elif ast[0] == 'name':
         print 'load_name', ast[1]
@@ -53,25 +56,25 @@ def stack_code(ast):
         print 'load_const', ast[1]
     elif ast[0] == 'stmt-seq':
         for sub in ast[1:]:
-            stack_code(sub)
+            stack_code(sub, label)
     elif ast[0] == 'expr-stmt':
-        stack_code(ast[1])
+        stack_code(ast[1], label)
         print 'pop'
     elif ast[0] == 'return':
-        stack_code(ast[1])
+        stack_code(ast[1], label)
         print 'ret'
     elif ast[0] == 'if-stmt':
-        stack_code(ast[1])
+        stack_code(ast[1], label)
         else_label = next(label)
         endif_label = next(label)
         print 'jump-if-false label%d' % else_label
-        stack_code(ast[2])
+        stack_code(ast[2], label)
         print 'jump label%d' % endif_label
         print 'label%d:  # else' % else_label
-        stack_code(ast[3])
+        stack_code(ast[3], label)
         print 'label%d:  # end if' % endif_label
     elif ast[0] == '=':
-        stack_code(ast[3])
+        stack_code(ast[3], label)
         if ast[2][0] == 'name':
             print 'store_name', ast[2][1]
         else:
@@ -79,7 +82,7 @@ def stack_code(ast):
     elif ast[0] == 'var-def':
         #print 'load_type', ast[2][1]
         #print 'make_var', ast[1][1]
-        stack_code(ast[3])
+        stack_code(ast[3], label)
         print 'store_name', ast[1][1]
     elif ast[0] == 'func-def':
         func_begin_label = next(label)
@@ -89,14 +92,14 @@ def stack_code(ast):
         for arg in reversed(ast[3][1:]):
             assert arg[0] == 'arg'
             print 'store_name', arg[1][1]
-        stack_code(ast[4])
+        stack_code(ast[4], label)
         print 'label%d: # end func %s' % (func_end_label, ast[1][1])
     elif ast[0] == 'func-call':
         args = ast[2]
         assert args[0] == 'call-args'
         for arg in ast[2][1:]:
-            stack_code(arg)
-        stack_code(ast[1])
+            stack_code(arg, label)
+        stack_code(ast[1], label)
         print 'call_func'
     else:
         raise Exception('Error producing stack code for %r' % ast[0])
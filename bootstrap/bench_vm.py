@@ -0,0 +1,100 @@
+'''benchmark the Kant vm: a recursive fib in the checked mode with typed
+values on the stack against the fast mode with type specialized opcodes,
+without and with the cache for pure functions, and a tail recursive counter
+that has to run in constant memory'''
+
+import sys
+import time
+import resource
+from StringIO import StringIO
+import lexer
+import parser
+import scopes
+import vm
+import build
+
+SOURCE = '''
+def fib(n:int):int
+{
+    if n==0 { return 0; }
+    if n==1 { return 1; }
+    return fib(n-1) + fib(n-2);
+}
+
+def main():int
+{
+    def result:int = fib(%d);
+    return 0;
+}
+'''
+
+COUNTER = '''
+def count(n:int, total:int):int
+{
+    if n==0 { return total; }
+    return count(n-1, total+1);
+}
+
+def main():int
+{
+    def result:int = count(%d, 0);
+    return 0;
+}
+'''
+
+def compile_source(source):  # @ReservedAssignment
+    tokens = lexer.scan(source, '<bench>')
+    tree = parser.Parser(tokens, '<bench>').program()
+    context = scopes.Context(build.error_function(source, '<bench>'))
+    code, globls = scopes.build(tree, context)
+    return code, globls.names['main'].value
+
+def run(bytecode, **options):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        vm.VM(bytecode, **options).execute()
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+def best_time(func, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main(n=20, repeat=3, iterations=1000000):
+    code, main_label = compile_source(SOURCE % n)
+    checked = vm.Bytecode(code, main_label, checked=True)
+    fast = vm.Bytecode(code, main_label)
+    assert run(checked) == run(fast, memo_size=0) == run(fast)
+    for name, bytecode, options in [('checked', checked, {}),
+                                    ('fast', fast, {'memo_size': 0}),
+                                    ('memoized', fast, {})]:
+        elapsed = best_time(lambda: run(bytecode, **options), repeat)
+        print '%-10s fib(%d) %8.3fs' % (name, n, elapsed)
+
+    # the maximum resident set size only grows, so the smaller run goes first
+    for count in (iterations // 10, iterations):
+        code, main_label = compile_source(COUNTER % count)
+        bytecode = vm.Bytecode(code, main_label)
+        rss = max_rss()
+        start = time.time()
+        output = run(bytecode)
+        elapsed = time.time() - start
+        assert output == 'result = %d\n' % count
+        print '%-10s count(%d) %8.3fs, max rss grew by %d kB' % ('tail call', count, elapsed, max_rss() - rss)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,187 @@
+'''build driver: compile many Kant source files in parallel and link them
+into one vm.Bytecode.
+
+    python build.py [-j JOBS] [-v] [--main NAME] [--run] [--checked]
+                   [--memo-size N] [--memo-policy lru|fifo]
+                   [--profile] [--collapsed FILE] DIRECTORY|MANIFEST
+
+a directory is searched recursively for .kant files, a manifest lists one
+file per line relative to the manifest (empty lines and lines starting with
+# are ignored). every file is lexed, parsed and built in a worker process.
+the files are compiled independently: each has its own global scope, so a
+function can only call functions of its own file.'''
+
+import sys
+import os
+import time
+import argparse
+import multiprocessing
+import lexer
+import parser
+import scopes
+import vm
+import ast
+
+# every file gets its own range of labels so that the code can be merged
+LABELS_PER_FILE = 1000000
+
+def error_function(source, filename, errors=None):
+    '''an error function for scopes.Context writing messages with the
+    source line to stderr. errors, if given, is a list that gets every
+    message appended.'''
+    def error(message, token, level='Error'):
+        if errors is not None:
+            errors.append(message)
+        if token is None:
+            # should be avoided for good error messages
+            sys.stderr.write('%s %s\n' % (level, message))
+        else:
+            lines = source.splitlines()
+            sys.stderr.write('%s\n%s^\n' % (lines[token.line_no-1], ' '*(token.col_no-1)))
+            sys.stderr.write('%s:%d:%d: %s %s\n' % (filename, token.line_no, token.col_no, level, message))
+    return error
+
+def find_sources(path):
+    if os.path.isdir(path):
+        sources = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.kant'):
+                    sources.append(os.path.join(dirpath, filename))
+        return sources
+    base = os.path.dirname(path)
+    with open(path, 'r') as manifest:
+        return [os.path.join(base, line.strip()) for line in manifest
+                if line.strip() and not line.startswith('#')]
+
+def compile_file(job):
+    '''compile one file in a worker.
+
+    returns a dict with the filename, the code, the labels of the global
+    functions, the number of errors and the time of every phase.'''
+    index, filename, verbose = job
+    timings = {}
+    start = time.time()
+    with open(filename, 'r') as infile:
+        source = infile.read()
+    timings['read'] = time.time() - start
+
+    start = time.time()
+    tokens = lexer.scan(source, filename, compact=True)
+    timings['lex'] = time.time() - start
+
+    start = time.time()
+    tree = parser.Parser(tokens, filename).program()
+    timings['parse'] = time.time() - start
+
+    errors = []
+    context = scopes.Context(error_function(source, filename, errors),
+                             first_label=100 + index * LABELS_PER_FILE)
+    start = time.time()
+    code, globls = scopes.build(tree, context)
+    timings['build'] = time.time() - start
+
+    if verbose:
+        print '%s:' % filename
+        print 'S-expr:', ast.stree(tree)
+        for line in code:
+            print '\t'.join(map(str, line))
+        print
+
+    functions = dict((name, symbol.value) for name, symbol in globls.names.items()
+                     if isinstance(symbol.type, tuple) and symbol.type[0] == 'func-type')
+    return {'filename': filename,
+            'code': code,
+            'functions': functions,
+            'errors': len(errors),
+            'timings': timings}
+
+def build(sources, jobs=None, verbose=False, main='main', checked=False):
+    '''compile the files in sources and merge them into one vm.Bytecode
+    starting at the function main, with run time type checks if checked is
+    true. returns the bytecode (None if there were errors) and the results
+    of compile_file in the order of sources.'''
+    work = [(index, filename, verbose) for index, filename in enumerate(sources)]
+    if jobs == 1:
+        results = map(compile_file, work)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(compile_file, work, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    nb_errors = sum(result['errors'] for result in results)
+    defined = {}
+    for result in results:
+        for name in result['functions']:
+            if name in defined:
+                sys.stderr.write('%s: Error function %r is also defined in %s\n'
+                                 % (result['filename'], name, defined[name]['filename']))
+                nb_errors += 1
+            else:
+                defined[name] = result
+    if main not in defined:
+        sys.stderr.write('Error no function %r defined\n' % main)
+        nb_errors += 1
+    if nb_errors:
+        return None, results
+
+    code = [instr for result in results for instr in result['code']]
+    return vm.Bytecode(code, defined[main]['functions'][main], checked), results
+
+def report(results, wall_time):
+    phases = ('read', 'lex', 'parse', 'build')
+    print '%-40s %s' % ('file', ' '.join('%8s' % phase for phase in phases))
+    totals = dict.fromkeys(phases, 0.0)
+    for result in results:
+        timings = result['timings']
+        print '%-40s %s' % (result['filename'], ' '.join('%8.4f' % timings[phase] for phase in phases))
+        for phase in phases:
+            totals[phase] += timings[phase]
+    print '%-40s %s' % ('total', ' '.join('%8.4f' % totals[phase] for phase in phases))
+    print '%d files, wall time %.3fs, compile time %.3fs' % (len(results), wall_time, sum(totals.values()))
+
+def main():
+    argparser = argparse.ArgumentParser(description='compile Kant source files in parallel')
+    argparser.add_argument('path', help='directory of .kant files or manifest file')
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help='number of worker processes (default: one per cpu)')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='dump the tree and code of every file')
+    argparser.add_argument('--main', default='main', help='function to start at')
+    argparser.add_argument('--run', action='store_true', help='run the program after building it')
+    argparser.add_argument('--checked', action='store_true', help='check the type of every value at run time')
+    argparser.add_argument('--memo-size', type=int, default=10000,
+                           help='number of results of pure functions to cache, 0 to disable')
+    argparser.add_argument('--memo-policy', choices=('lru', 'fifo'), default='lru',
+                           help='eviction policy of the cache')
+    argparser.add_argument('--profile', action='store_true', help='profile the run and print the report')
+    argparser.add_argument('--collapsed', metavar='FILE',
+                           help='write the profiled stacks in the collapsed format for flamegraphs')
+    args = argparser.parse_args()
+
+    start = time.time()
+    bytecode, results = build(find_sources(args.path), args.jobs, args.verbose, args.main, args.checked)
+    report(results, time.time() - start)
+    if bytecode is None:
+        sys.exit(1)
+    if args.run:
+        the_vm = vm.VM(bytecode, memo_size=args.memo_size, memo_policy=args.memo_policy)
+        profile = None
+        if args.profile or args.collapsed:
+            names = dict((label, name) for result in results for name, label in result['functions'].items())
+            profile = vm.Profile(names)
+        the_vm.execute(profile)
+        if args.profile:
+            profile.report()
+        if args.collapsed:
+            with open(args.collapsed, 'w') as outfile:
+                profile.write_collapsed(outfile)
+        if args.verbose and the_vm.memo is not None:
+            print 'memo: %d hits, %d misses, %d evictions' % (
+                the_vm.memo.hits, the_vm.memo.misses, the_vm.memo.evictions)
+
+if __name__ == '__main__':
+    main()
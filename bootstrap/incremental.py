@@ -0,0 +1,231 @@
+'''incremental compilation: the code of every top level function is cached
+on disk and reused as long as the function's source and the signatures of
+the functions it calls are unchanged.
+
+the source is split at the top level definitions with a regex that only
+looks for comments and braces; only new or changed functions are lexed,
+parsed and built. a cached function keeps the labels and variable ids it
+was built with, together with the labels of the functions it calls. when
+it is reused it takes as many labels and ids from the context as a new
+build would, and its code is renumbered only if they differ, so the result
+is the same as that of a full build.'''
+
+import os
+import re
+import hashlib
+import marshal
+import lexer
+import parser
+import scopes
+import build
+
+CACHE_VERSION = 3
+
+def cache_file(cache_dir, filename):
+    key = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(cache_dir, key + '.kc')
+
+def load_cache(path):
+    try:
+        with open(path, 'rb') as infile:
+            version, entries = marshal.load(infile)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    if version != CACHE_VERSION:
+        return {}
+    return entries
+
+def save_cache(path, entries):
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_file, 'wb') as outfile:
+            marshal.dump((CACHE_VERSION, entries), outfile)
+        os.rename(tmp_file, path)
+    except (IOError, OSError, ValueError):
+        pass
+
+# comments, braces and the start of a function definition
+SPLIT = re.compile(r'/\*.*?(?:\*/|\Z)|//[^\n]*|[{}]|\bdef\s+[_a-zA-Z]\w*\s*\(', re.S)
+
+def split_definitions(source):
+    '''split a program into top level chunks without lexing it.
+
+    returns (start, stop, is_function) offset ranges; a function chunk
+    runs from "def name (" to the closing brace of its body, the text
+    between functions is in other chunks.'''
+    chunks = []
+    depth = 0
+    function = None
+    last = 0
+    for match in SPLIT.finditer(source):
+        text = match.group()
+        if text == '{':
+            depth += 1
+        elif text == '}':
+            depth -= 1
+            if depth == 0 and function is not None:
+                chunks.append((function, match.end(), True))
+                function = None
+                last = match.end()
+        elif depth == 0 and function is None and text.startswith('def'):
+            if source[last:match.start()].strip():
+                chunks.append((last, match.start(), False))
+            function = match.start()
+    if function is not None:
+        chunks.append((function, len(source), True))
+    elif source[last:].strip():
+        chunks.append((last, len(source), False))
+    return chunks
+
+def declared_names(tree):
+    '''the names a function definition declares: arguments, variables and
+    nested functions'''
+    names = []
+    if tree[0] == 'func-def':
+        names.append(tree[1][1])
+        names.extend(arg[1][1] for arg in tree[3][1:])
+        names.extend(declared_names(tree[4]))
+    elif tree[0] == 'var-def':
+        names.append(tree[1][1])
+    elif tree[0] == 'stmt-seq':
+        for stmt in tree[1:]:
+            names.extend(declared_names(stmt))
+    elif tree[0] == 'if-stmt':
+        names.extend(declared_names(tree[2]))
+        names.extend(declared_names(tree[3]))
+    return names
+
+LABEL_OPS = ('label', 'jump', 'jump_if_false', 'call', 'tail_call')
+VARIABLE_OPS = ('load_local', 'store_local', 'load_name', 'store_name')
+
+def id_ranges(blocks):
+    '''the first label and number of labels, the first variable id and
+    number of variable ids of the code of a function, and the labels it
+    uses that it does not define (the global functions it calls).
+
+    a function gets its labels and variables one after the other while it is
+    built, so both form a range starting at the smallest one.'''
+    labels = []
+    varids = []
+    used = set()
+    for block in blocks:
+        for instr in block:
+            if instr[0] == 'label':
+                labels.append(instr[1])
+            elif instr[0] in LABEL_OPS:
+                used.add(instr[1])
+            elif instr[0] in VARIABLE_OPS and len(instr) > 3:
+                varids.append(instr[3])
+    first_label = min(labels)
+    first_varid = min(varids) if varids else 0
+    nb_variables = max(varids) - first_varid + 1 if varids else 0
+    return (first_label, max(labels) - first_label + 1,
+            first_varid, nb_variables, used.difference(labels))
+
+def relink(entry, globls):
+    '''take fresh labels and variable ids from the context for the cached
+    code in entry and renumber it if they differ from the cached ones.
+    returns the code and the label of the function.'''
+    name, signature, deps, names, ids, blocks = entry
+    first_label, nb_labels, own_label, first_varid, nb_variables = ids
+    context = globls.context
+    label_delta = next(context.label) - first_label
+    for _ in xrange(nb_labels - 1):
+        next(context.label)
+    varid_delta = 0
+    if nb_variables:
+        varid_delta = next(context.variable) - first_varid
+        for _ in xrange(nb_variables - 1):
+            next(context.variable)
+    calls = dict((dep_label, globls.names[dep].value) for dep, dep_signature, dep_label in deps)
+    if not label_delta and not varid_delta and all(old == new for old, new in calls.items()):
+        return blocks, own_label
+
+    last_label = first_label + nb_labels
+    result = []
+    for block in blocks:
+        new_block = []
+        for instr in block:
+            if instr[0] in LABEL_OPS:
+                if first_label <= instr[1] < last_label:
+                    instr = (instr[0], instr[1] + label_delta)
+                else:
+                    instr = (instr[0], calls[instr[1]])
+            elif instr[0] in VARIABLE_OPS and len(instr) > 3:
+                instr = instr[:3] + (instr[3] + varid_delta,) + instr[4:]
+            new_block.append(instr)
+        result.append(new_block)
+    return result, own_label + label_delta
+
+def reusable(entry, globls):
+    name, signature, deps, names, ids, blocks = entry
+    for dep, dep_signature, dep_label in deps:
+        symbol = globls.names.get(dep)
+        if symbol is None or symbol.type != dep_signature:
+            return False
+    # a declaration that now collides with a global has to report its error
+    for declared in names:
+        if globls.resolve(declared) is not None:
+            return False
+    return True
+
+def compile(source, filename, cache_dir):  # @ReservedAssignment
+    '''compile like lang.compile, reusing the cached code of unchanged
+    functions. returns the code, the global scope and the number of
+    functions that were taken from the cache.'''
+    path = cache_file(cache_dir, filename)
+    cached = load_cache(path)
+    entries = {}
+
+    errors = []
+    context = scopes.Context(build.error_function(source, filename, errors))
+    globls = scopes.global_scope(context)
+    code_blocks = []
+    nb_reused = 0
+    # label -> name of the global functions defined so far
+    functions = {}
+
+    for start, stop, is_function in split_definitions(source):
+        tokens = lexer.scan(source, filename, start=start, stop=stop)
+        if not is_function:
+            the_parser = parser.Parser(tokens, filename)
+            scopes.walk(the_parser.statement_seq(), globls, None, None, code_blocks)
+            continue
+
+        span = source[start:stop]
+        key = hashlib.sha1(span).hexdigest()
+        entry = cached.get(key)
+        if entry is not None and reusable(entry, globls):
+            blocks, label = relink(entry, globls)
+            next(tokens)
+            globls.add_name(entry[0], next(tokens), entry[1], 0, label)
+            code_blocks.extend(blocks)
+            functions[label] = entry[0]
+            entries[key] = entry
+            nb_reused += 1
+            continue
+
+        the_parser = parser.Parser(tokens, filename)
+        tree = the_parser.definition()
+        nb_errors = len(errors)
+        first_block = len(code_blocks)
+        scopes.walk(tree, globls, None, None, code_blocks)
+        if the_parser.errors or len(errors) != nb_errors:
+            continue
+        name = tree[1][1]
+        symbol = globls.names[name]
+        functions[symbol.value] = name
+        blocks = code_blocks[first_block:]
+        first_label, nb_labels, first_varid, nb_variables, called = id_ranges(blocks)
+        deps = [(functions[label], globls.names[functions[label]].type, label)
+                for label in sorted(called)]
+        ids = (first_label, nb_labels, symbol.value, first_varid, nb_variables)
+        entries[key] = (name, symbol.type, deps, declared_names(tree), ids, blocks)
+
+    if set(entries) != set(cached):
+        save_cache(path, entries)
+    code = scopes.mark_pure([x for block in code_blocks for x in block])
+    return code, globls, nb_reused
@@ -3,7 +3,8 @@ import parser
 import ast
 import scopes
 import vm
-import sys
+import build
+import incremental
 from pprint import pprint
 
 tokens = lexer.tokenize('''
@@ -40,30 +41,27 @@ tree = parser.program()
 print
 ast.ptree(tree)
 
-def compile(source, filename):  # @ReservedAssignment
-    tokens = lexer.tokenize(source)
-    parser.init(tokens)
-    tree = parser.program()
-    def error(message, token, level='Error'):
-        if token is None:
-            # should be avoided for good error messages
-            sys.stderr.write('%s %s\n' % (level, message))
-        else:
-            lines = source.splitlines()
-            sys.stderr.write('%s\n%s^\n' % (lines[token.line_no-1], ' '*(token.col_no-1)))
-            sys.stderr.write('%s:%d:%d: %s %s\n' % (filename, token.line_no, token.col_no, level, message))
-    scopes.error = error
-    
-    print 'S-expr:', ast.stree(tree)
-    print
-    ast.ptree(tree)
-    print
-    code, globls = scopes.build(tree)
-    for name, symbol in globls.names.items():
-        print name, symbol
-    print
-    for line in code:
-        print '\t'.join(map(str, line))
+def compile(source, filename, verbose=False, cache_dir=None):  # @ReservedAssignment
+    if cache_dir is not None:
+        # reuse the code of unchanged functions, there is no whole tree to dump
+        code, globls, nb_reused = incremental.compile(source, filename, cache_dir)
+    else:
+        tokens = lexer.scan(source, filename)
+        tree = parser.Parser(tokens, filename).program()
+        context = scopes.Context(build.error_function(source, filename))
+        
+        if verbose:
+            print 'S-expr:', ast.stree(tree)
+            print
+            ast.ptree(tree)
+            print
+        code, globls = scopes.build(tree, context)
+    if verbose:
+        for name, symbol in globls.names.items():
+            print name, symbol
+        print
+        for line in code:
+            print '\t'.join(map(str, line))
     return code, globls
 
 
@@ -86,7 +84,7 @@ def main():int
 
 '''
     
-code, names = compile(source, '<source>')
+code, names = compile(source, '<source>', verbose=True)
 
 
 
@@ -1,4 +1,7 @@
 import sys
+import re
+import bisect
+from array import array
 from collections import namedtuple
 
 Token = namedtuple('Token', 'type, lexeme, filename, line_no, col_no')
@@ -182,3 +185,180 @@ def tokenize(chars, filename='<filename>'):
 
         else:
             assert False, 'Illegal State %r' % s
+
+
+# buffer based lexer: works on a str or mmap with index arithmetic and
+# slicing instead of one call per character. Tokens carry the buffer
+# offset; line and column are computed from a table of line starts only
+# when they are asked for.
+
+SPACE = re.compile(r'[ \t\n]*')
+NAME = re.compile(r'[_a-zA-Z][_a-zA-Z0-9]*')
+DIGITS = re.compile(r'[0-9]*')
+OP_RUN = re.compile(r'[-+*/%<>=!][-+*/%<>=]*')
+
+NAME_START = frozenset('_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+PUNCTUATION = frozenset('(){}[];:,')
+OP_START = frozenset('+-*/%<>=!')
+
+class Source(object):
+    '''a buffer with its file name and, once needed, the offsets of its line starts'''
+    def __init__(self, buf, filename):
+        self.buf = buf
+        self.filename = filename
+        self._line_starts = None
+
+    def line_starts(self):
+        if self._line_starts is None:
+            starts = array('l', [0])
+            pos = self.buf.find('\n')
+            while pos >= 0:
+                starts.append(pos + 1)
+                pos = self.buf.find('\n', pos + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def line_col(self, offset):
+        '''line and column of offset, counted as tokenize() does'''
+        starts = self.line_starts()
+        line_no = bisect.bisect_right(starts, offset)
+        col_no = offset - starts[line_no - 1] + 1
+        if offset == len(self.buf):
+            # the end token sits on the last character read, not after it
+            col_no -= 1
+        return line_no, col_no
+
+    def error(self, offset, msg):
+        sys.stderr.write('%s:%d:%d: %s\n' % ((self.filename,) + self.line_col(offset) + (msg,)))
+
+class BufferToken(namedtuple('BufferToken', 'type, lexeme, source, offset')):
+    '''a Token that knows its offset instead of its line and column'''
+    __slots__ = ()
+
+    @property
+    def filename(self):
+        return self.source.filename
+
+    @property
+    def line_no(self):
+        return self.source.line_col(self.offset)[0]
+
+    @property
+    def col_no(self):
+        return self.source.line_col(self.offset)[1]
+
+    def __repr__(self):
+        return 'Token(type=%r, lexeme=%r, filename=%r, line_no=%r, col_no=%r)' % (
+            self.type, self.lexeme, self.filename, self.line_no, self.col_no)
+
+class TokenArray(object):
+    '''tokens kept in parallel arrays, BufferTokens are made on access'''
+    def __init__(self, source):
+        self.source = source
+        self.types = []
+        self.lexemes = []
+        self.offsets = array('l')
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return BufferToken(self.types[index], self.lexemes[index], self.source, self.offsets[index])
+
+    def __iter__(self):
+        for index in xrange(len(self.types)):
+            yield self[index]
+
+def scan_number(source, pos):
+    '''scan the number starting at pos.
+    returns the lexeme (None after an error) and the position after it.'''
+    buf = source.buf
+    start = pos
+    if buf[pos] == '.':
+        if not buf[pos+1:pos+2].isdigit():
+            source.error(start, 'invalid token . (not part of a number)')
+            return None, min(pos + 2, len(buf))
+        pos += 1
+    pos = DIGITS.match(buf, pos).end()
+    c = buf[pos:pos+1]
+    if c == '.' and buf[start] != '.':
+        pos = DIGITS.match(buf, pos + 1).end()
+        c = buf[pos:pos+1]
+    if c == '.':
+        source.error(start, 'invalid number, two decimal points')
+        return None, pos + 1
+    if c and c in 'eE':
+        pos += 1
+        if buf[pos:pos+1] in ('+', '-'):
+            pos += 1
+        if not buf[pos:pos+1].isdigit():
+            source.error(start, 'invalid number, missing exponent after "E"')
+            return None, min(pos + 1, len(buf))
+        pos = DIGITS.match(buf, pos).end()
+    return intern(buf[start:pos]), pos
+
+def scan_tokens(source, pos=0, end=None):
+    '''generate (type, lexeme, offset) for the tokens of source from pos to
+    end, ending with 'end'. pos and end must not be inside a token.'''
+    buf = source.buf
+    if end is None:
+        end = len(buf)
+    while True:
+        pos = SPACE.match(buf, pos).end()
+        if pos >= end:
+            yield 'end', '', end
+            return
+        c = buf[pos]
+        if c in NAME_START:
+            stop = NAME.match(buf, pos).end()
+            lexeme = intern(buf[pos:stop])
+            if lexeme in keywords:
+                yield lexeme, lexeme, pos
+            else:
+                yield 'name', lexeme, pos
+            pos = stop
+        elif c in PUNCTUATION:
+            yield c, c, pos
+            pos += 1
+        elif c in OP_START:
+            stop = OP_RUN.match(buf, pos).end()
+            run = buf[pos:stop]
+            comment = min(i for i in (run.find('/*'), run.find('//'), len(run)) if i >= 0)
+            if comment < len(run):
+                # the operator characters before the comment are dropped, as in tokenize()
+                if run[comment+1] == '*':
+                    close = buf.find('*/', pos + comment + 2)
+                    pos = end if close < 0 else close + 2
+                else:
+                    newline = buf.find('\n', pos + comment + 2)
+                    pos = end if newline < 0 else newline + 1
+            elif run in operators:
+                run = intern(run)
+                yield run, run, pos
+                pos = stop
+            else:
+                source.error(pos, 'illegal operator %r' % run)
+                pos = stop
+        elif c.isdigit() or c == '.':
+            start = pos
+            lexeme, pos = scan_number(source, pos)
+            if lexeme is not None:
+                yield 'num', lexeme, start
+        else:
+            source.error(pos, 'Illegal character %r' % c)
+            pos += 1
+
+def scan(buf, filename='<filename>', compact=False, start=0, stop=None):
+    '''tokenize a str or mmap buffer, or the part from start to stop.
+
+    returns an iterator of BufferTokens, or with compact=True a TokenArray.
+    The tokens are the same as those of tokenize(buf, filename).'''
+    source = Source(buf, filename)
+    if compact:
+        tokens = TokenArray(source)
+        for typ, lexeme, offset in scan_tokens(source, start, stop):
+            tokens.types.append(typ)
+            tokens.lexemes.append(lexeme)
+            tokens.offsets.append(offset)
+        return tokens
+    return (BufferToken(typ, lexeme, source, offset) for typ, lexeme, offset in scan_tokens(source, start, stop))
@@ -1,199 +1,273 @@
 import sys
 
+class Parser:
+    '''recursive descent parser over a token stream.
+
+    all state is in the instance, so several sources can be parsed at
+    the same time.'''
+    def __init__(self, token_stream, filename='<filename>'):
+        self.filename = filename
+        self.tokens = iter(token_stream)
+        self.next_token = None
+        self.errors = 0
+        self.consume()
+
+    def consume(self):
+        self.next_token = next(self.tokens)
+
+    def error(self, msg, token):
+        self.errors += 1
+        sys.stderr.write('%s:%d:%d: %s\n' % (token.filename, token.line_no, token.col_no, msg))
+        return ('error', token, msg)
+
+    def expect(self, token_type):
+        if self.next_token.type == token_type:
+            ret = self.next_token
+            self.consume()
+            return ret
+        else:
+            return self.error('Expected %r, got %r' % (token_type, self.next_token.lexeme), self.next_token)
+
+    def program(self):
+        result = self.statement_seq()
+        if self.next_token.type == 'end':
+            return result
+        else:
+            return self.error('expected end of file, got %r' % (self.next_token.lexeme,), self.next_token)
+
+    def name(self):
+        n = self.expect('name')
+        return n
+
+    def number(self):
+        n = self.expect('num')
+        return n
+
+    def definition(self):
+        self.expect('def')
+        n = self.name()
+        if self.next_token.type == '(':
+            p = self.argument_list()
+            self.expect(':')
+            t = self.type_expression()
+            b = self.block()
+            return ('func-def', n, t, p, b)
+        else:
+            self.expect(':')
+            t = self.type_expression()
+            self.expect('=')
+            e = self.expression()
+            self.expect(';')
+            return ('var-def', n, t, e)
+
+    def argument_list(self):
+        self.expect('(')
+        args = []
+        while self.next_token.type != ')':
+            n = self.name()
+            self.expect(':')
+            t = self.type_expression()
+            args.append(('arg', n, t))
+            if self.next_token.type == ',':
+                self.consume()
+            else:
+                break
+        self.expect(')')
+        return ('arg-list',) + tuple(args)
+
+    def type_expression(self):
+        # for now the only way to specify a type is by its name
+        return self.name()
+
+    def block(self):
+        self.expect('{')
+        result = self.statement_seq()
+        self.expect('}')
+        return result
+
+    def statement_seq(self):
+        result = []
+        while self.next_token.type not in ('}', 'end'):
+            result.append(self.statement())
+        return ('stmt-seq',) + tuple(result)
+
+    def statement(self):
+        if self.next_token.type == ';':
+            self.consume()
+            return ('nop',)
+        elif self.next_token.type == 'if':
+            self.consume()
+            condition = self.expression()
+            if_block = self.block()
+            if self.next_token.type == 'else':
+                self.consume()
+                else_block = self.block()
+            else:
+                else_block = ('stmt-seq',)
+            return ('if-stmt', condition, if_block, else_block)
+        elif self.next_token.type == 'def':
+            return self.definition()
+        elif self.next_token.type == 'return':
+            tok = self.next_token
+            self.consume()
+            expr = self.expression()
+            self.expect(';')
+            return ('return', tok, expr)
+        else:
+            result = ('expr-stmt', self.expression())
+            self.expect(';')
+            return result
+
+    def expression(self):
+        result = self.disjunction()
+        if self.next_token.type in ('=', '+=', '*=', '/=', '%='):
+            op = self.next_token
+            self.consume()
+            return (op.type, op, result, self.disjunction())
+        else:
+            return result
+
+    def disjunction(self):
+        result = self.conjunction()
+        while self.next_token.type == 'or':
+            op = self.next_token
+            self.consume()
+            result = (op.type, op, result, self.conjunction())
+        return result
+
+    def conjunction(self):
+        result = self.comparison()
+        while self.next_token.type == 'and':
+            op = self.next_token
+            self.consume()
+            result = (op.type, op, result, self.comparison())
+        return result
+
+    def comparison(self):
+        result = self.factor()
+        if self.next_token.type == '==':
+            op = self.next_token
+            self.consume()
+            return (op.type, op, result, self.factor())
+        return result
+
+    def factor(self):
+        result = self.term()
+        while self.next_token.type in ('+', '-'):
+            op = self.next_token
+            self.consume()
+            result = (op.type, op, result, self.term())
+        return result
+
+    def term(self):
+        result = self.function_call()
+        assert result
+        while self.next_token.type in ('*', '/', '%'):
+            op = self.next_token
+            self.consume()
+            result = (op.type, op, result, self.function_call())
+            assert result
+        assert result
+        return result
+
+    def call_args(self):
+        self.expect('(')
+        params = []
+        while self.next_token.type != ')':
+            params.append(self.expression())
+            if self.next_token.type == ',':
+                self.consume()
+            else:
+                self.expect(')')
+                break
+        return ('call-args',) + tuple(params)
+
+    def function_call(self):
+        result = self.primary()
+        while self.next_token.type == '(':
+            result = ('func-call', result, self.call_args())
+        return result
+
+    def primary(self):
+        if self.next_token.type == 'name':
+            return self.name()
+        elif self.next_token.type == 'num':
+            return self.number()
+        elif self.next_token.type == '(':
+            self.consume()
+            result = self.expression()
+            self.expect(')')
+            return result
+        else:
+            return self.error('Expected a name, number, or (, got %r' % (self.next_token.lexeme,), self.next_token)
+
+# module level interface, parsing one source at a time with a shared Parser
+
+parser = None
+
 def init(token_stream, filename_ = '<filename>'):
-    global tokens
-    global filename
-    filename = filename_
-    tokens = iter(token_stream)
-    consume()
+    global parser
+    parser = Parser(token_stream, filename_)
 
 def consume():
-    global next_token
-    next_token = next(tokens)
-    
+    parser.consume()
+
 def error(msg, token):
-    sys.stderr.write('%s:%d:%d: %s\n' % (token.filename, token.line_no, token.col_no, msg))
-    return ('error', token, msg)
-    
+    return parser.error(msg, token)
+
 def expect(token_type):
-    if next_token.type == token_type:
-        ret = next_token
-        consume()
-        return ret
-    else:
-        return error('Expected %r, got %r' % (token_type, next_token.lexeme), next_token)
+    return parser.expect(token_type)
 
 def program():
-    result = statement_seq()
-    if next_token.type == 'end':
-        return result
-    else:
-        return error('expected end of file, got %r' % (next_token,))
+    return parser.program()
 
 def name():
-    n = expect('name')
-    return n
+    return parser.name()
 
 def number():
-    n = expect('num')
-    return n
+    return parser.number()
 
 def definition():
-    expect('def')
-    n = name()
-    if next_token.type == '(':
-        p = argument_list()
-        expect(':')
-        t = type_expression()
-        b = block()
-        return ('func-def', n, t, p, b)
-    else:
-        expect(':')
-        t = type_expression()
-        expect('=')
-        e = expression()
-        expect(';')
-        return ('var-def', n, t, e)
+    return parser.definition()
 
 def argument_list():
-    expect('(')
-    args = []
-    while next_token.type != ')':
-        n = name()
-        expect(':')
-        t = type_expression()
-        args.append(('arg', n, t))
-        if next_token.type == ',':
-            consume()
-        else:
-            break
-    expect(')')
-    return ('arg-list',) + tuple(args)
+    return parser.argument_list()
 
 def type_expression():
-    # for now the only way to specify a type is by its name
-    return name()
+    return parser.type_expression()
 
 def block():
-    expect('{')
-    result = statement_seq()
-    expect('}')
-    return result
+    return parser.block()
 
 def statement_seq():
-    result = []
-    while next_token.type not in ('}', 'end'):
-        result.append(statement())
-    return ('stmt-seq',) + tuple(result)
+    return parser.statement_seq()
 
 def statement():
-    if next_token.type == ';':
-        consume()
-        return ('nop',)
-    elif next_token.type == 'if':
-        consume()
-        condition = expression()
-        if_block = block()
-        if next_token.type == 'else':
-            consume()
-            else_block = block()
-        else:
-            else_block = ('stmt-seq',)
-        return ('if-stmt', condition, if_block, else_block)
-    elif next_token.type == 'def':
-        return definition()
-    elif next_token.type == 'return':
-        tok = next_token
-        consume()
-        expr = expression()
-        expect(';')
-        return ('return', tok, expr)
-    else:
-        result = ('expr-stmt', expression())
-        expect(';')
-        return result
+    return parser.statement()
 
 def expression():
-    result = disjunction()
-    if next_token.type in ('=', '+=', '*=', '/=', '%='):
-        op = next_token
-        consume()
-        return (op.type, op, result, disjunction())
-    else:
-        return result
-    
+    return parser.expression()
+
 def disjunction():
-    result = conjunction()
-    while next_token.type == 'or':
-        op = next_token
-        consume()
-        result = (op.type, op, result, conjunction())
-    return result
-     
+    return parser.disjunction()
+
 def conjunction():
-    result = comparison()
-    while next_token.type == 'and':
-        op = next_token
-        consume()
-        result = (op.type, op, result, comparison())
-    return result
-     
+    return parser.conjunction()
+
 def comparison():
-    result = factor()
-    if next_token.type == '==':
-        op = next_token
-        consume()
-        return (op.type, op, result, factor())
-    return result
+    return parser.comparison()
 
 def factor():
-    result = term()
-    while next_token.type in ('+', '-'):
-        op = next_token
-        consume()
-        result = (op.type, op, result, term())
-    return result
+    return parser.factor()
 
 def term():
-    result = function_call()
-    assert result
-    while next_token.type in ('*', '/', '%'):
-        op = next_token
-        consume()
-        result = (op.type, op, result, function_call())
-        assert result
-    assert result
-    return result
+    return parser.term()
 
 def call_args():
-    expect('(')
-    params = []
-    while next_token.type != ')':
-        params.append(expression())
-        if next_token.type == ',':
-            consume()
-        else:
-            expect(')')
-            break
-    return ('call-args',) + tuple(params)
+    return parser.call_args()
 
 def function_call():
-    result = primary()
-    while next_token.type == '(':
-        result = ('func-call', result, call_args())
-    return result
+    return parser.function_call()
 
 def primary():
-    if next_token.type == 'name':
-        return name()
-    elif next_token.type == 'num':
-        return number()
-    elif next_token.type == '(':
-        consume()
-        result = expression()
-        expect(')')
-        return result
-    else:
-        return error('Expected a name, number, or (, got %r' % (next_token.lexeme,), next_token)
-
-        
+    return parser.primary()
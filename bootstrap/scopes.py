@@ -2,7 +2,7 @@ from collections import namedtuple
 from itertools import count
 import operator
 
-Symbol = namedtuple('Symbol', 'token, type, alloc, value, varid, scope')
+Symbol = namedtuple('Symbol', 'token, type, alloc, value, varid, scope, slot')
 
 BUILTIN_TYPE_INT =   '[builtin type integer]'
 BUILTIN_TYPE_FLOAT = '[builtin type float]'
@@ -14,25 +14,39 @@ BUILTIN_TYPE_ASSIGNMENT = '[builtin type assignment]'
 def error(*args):
     raise NotImplementedError
 
+class Context:
+    '''the state of one compilation: the label and variable counters and
+    the error reporting function. build() makes a fresh one unless given
+    one, so ids start from the same numbers for every compilation.'''
+    def __init__(self, error_function=None, first_label=100, first_variable=10000):
+        self.label = count(first_label)
+        self.variable = count(first_variable)
+        self.error_function = error_function
+
+    def error(self, *args):
+        if self.error_function is None:
+            # the module level function, which callers may replace
+            return error(*args)
+        return self.error_function(*args)
+
 def sizeof(typ):
     return {BUILTIN_TYPE_INT: 4,
             BUILTIN_TYPE_FLOAT: 8,
             BUILTIN_TYPE_BOOL: 1,
             BUILTIN_TYPE_BYTE: 1}[typ]
 
-variable = count(10000)
-
 class Scope:
-    def __init__(self, parent, frame):
+    def __init__(self, parent, frame, context):
         self.names = {}
         self.parent = parent
         self.frame = frame
+        self.context = context
         
     def new_child(self):
-        return Scope(self, self.frame)
+        return Scope(self, self.frame, self.context)
     
     def new_function(self):
-        return Scope(self, [])
+        return Scope(self, [], self.context)
     
     def resolve(self, name):
         scope = self
@@ -44,14 +58,15 @@ class Scope:
     def add_name(self, name, token, typ, allocate, value):
         #print 'registering name %r of type %r' % (name, typ)
         if self.resolve(name):
-            error('Redefining name %s is not permitted' % name, token)
+            self.context.error('Redefining name %s is not permitted' % name, token)
         else:
             if allocate:
-                varid = next(variable)
-                self.names[name] = symb = Symbol(token, typ, allocate, value, varid, self)
+                # the slot is the index of the variable in the frame of its function
+                varid = next(self.context.variable)
+                self.names[name] = symb = Symbol(token, typ, allocate, value, varid, self, len(self.frame))
                 self.frame.append((varid, typ))
             else:
-                self.names[name] = symb = Symbol(token, typ, allocate, value, None, self)
+                self.names[name] = symb = Symbol(token, typ, allocate, value, None, self, None)
             return symb
     
     
@@ -66,8 +81,9 @@ class CodeConstants():
             self.const_ptr += size
         return self.constants[value][0]
 
-def build(ast):
-    builtins = Scope(None, [])
+def global_scope(context):
+    '''the scope for the global names of a program, inside the builtins'''
+    builtins = Scope(None, [], context)
     builtins.add_name('int',   None, BUILTIN_TYPE_TYPE, 0, BUILTIN_TYPE_INT)
     builtins.add_name('float', None, BUILTIN_TYPE_TYPE, 0, BUILTIN_TYPE_FLOAT)
     builtins.add_name('type',  None, BUILTIN_TYPE_TYPE, 0, BUILTIN_TYPE_TYPE)
@@ -75,15 +91,64 @@ def build(ast):
     builtins.add_name('byte',  None, BUILTIN_TYPE_TYPE, 0, BUILTIN_TYPE_BOOL)
     builtins.add_name('true',  None, BUILTIN_TYPE_BOOL, 0, True)
     builtins.add_name('false', None, BUILTIN_TYPE_BOOL, 0, False)
-    
+    return builtins.new_function()
+
+def build(ast, context=None):
+    if context is None:
+        context = Context()
     code_blocks = []
-    globals = builtins.new_function()
+    globals = global_scope(context)
     walk(ast, globals, None, None, code_blocks)
     code = [x for block in code_blocks for x in block]
-    return code, globals
-    
+    return mark_pure(code), globals
+
+SCALAR_TYPES = (BUILTIN_TYPE_INT, BUILTIN_TYPE_FLOAT, BUILTIN_TYPE_BOOL)
 
-label = count(100)
+# instructions that only touch the stack and the frame of the function
+PURE_OPS = ('#', 'label', 'enter', 'load_const', 'load_local', 'store_local',
+            'call', 'tail_call', 'ret', 'pop', 'jump', 'jump_if_false',
+            'add', 'sub', 'mul', 'div', 'mod', 'eq')
+
+def mark_pure(code):
+    '''find the pure functions in code: they take and return only ints,
+    floats and bools, use no variables of other frames and call only pure
+    functions. returns the code with a ('pure',) instruction after the
+    'enter' of each of them.'''
+    # label -> [pure so far, labels of the called functions]
+    functions = {}
+    function = None
+    for instr in code:
+        if instr[0] == 'label':
+            label = instr[1]
+        elif instr[0] == 'enter':
+            function = functions[label] = [all(typ in SCALAR_TYPES for typ in instr[1]), set()]
+        elif function is None:
+            continue
+        elif instr[0] not in PURE_OPS:
+            function[0] = False
+        elif instr[0] in ('call', 'tail_call'):
+            function[1].add(instr[1])
+        elif instr[0] == 'ret' and instr[1] not in SCALAR_TYPES:
+            function[0] = False
+
+    changed = True
+    while changed:
+        changed = False
+        for function in functions.values():
+            if function[0] and not all(callee in functions and functions[callee][0]
+                                       for callee in function[1]):
+                function[0] = False
+                changed = True
+
+    result = []
+    for instr in code:
+        result.append(instr)
+        if instr[0] == 'label':
+            label = instr[1]
+        elif instr[0] == 'enter' and functions[label][0]:
+            result.append(('pure',))
+    return result
+    
 
 def walk(ast, scope, current_function, current_code_block, code_blocks):
     def emit(*args):
@@ -97,19 +162,24 @@ def walk(ast, scope, current_function, current_code_block, code_blocks):
         expr = walk_expression(ast[2], scope)
         func = scope.resolve(current_function)
         if func.type[1] != expr.type:
-            error('function %r is declared as returning %r, but returns %r.' % (current_function, func.type[1], expr.type), 
+            scope.context.error('function %r is declared as returning %r, but returns %r.' % (current_function, func.type[1], expr.type), 
                   ast[1])
-        current_code_block.extend(expr.code)
-        emit('ret', expr.type)
+        if ast[2][0] == 'func-call' and expr.code[-1][0] == 'call':
+            # a tail call: the callee takes over the frame and returns to our caller
+            current_code_block.extend(expr.code[:-1])
+            emit('tail_call', expr.code[-1][1])
+        else:
+            current_code_block.extend(expr.code)
+            emit('ret', expr.type)
     elif ast[0] == 'stmt-seq':
         for stmt in ast[1:]:
             walk(stmt, scope, current_function, current_code_block, code_blocks)
     elif ast[0] == 'if-stmt':
-        else_label = next(label)
-        end_label = next(label)
+        else_label = next(scope.context.label)
+        end_label = next(scope.context.label)
         condition = walk_expression(ast[1], scope)
         if condition.type != BUILTIN_TYPE_BOOL:
-            error('if-condition must be boolean')
+            scope.context.error('if-condition must be boolean')
         current_code_block.extend(condition.code)
         emit('jump_if_false', else_label)
         walk(ast[2], scope, current_function, current_code_block, code_blocks)
@@ -126,21 +196,21 @@ def walk(ast, scope, current_function, current_code_block, code_blocks):
                 op = 'store_local'
             else:
                 op = 'store_name'
-            emit(op, ast[2][1], symb.type, symb.varid)
+            emit(op, ast[2][1], symb.type, symb.varid, symb.slot)
     elif ast[0] == 'var-def':
         # find the type
         declared_type = get_type(ast[2], scope)
         # evaluate the expression before adding the name to the scope
         expression = walk_expression(ast[3], scope)
         if expression.type != declared_type:
-            error('Declared type %r does not match expression type %r' % (declared_type, expression.type), ast[1])
+            scope.context.error('Declared type %r does not match expression type %r' % (declared_type, expression.type), ast[1])
 
         # add the name to the scope and store the result
         symb = scope.add_name(ast[1][1], ast[1], declared_type, 1, None)
         current_code_block.extend(expression.code)
-        emit('store_local', ast[1][1], symb.type, symb.varid)
+        emit('store_local', ast[1][1], symb.type, symb.varid, symb.slot)
     elif ast[0] == 'func-def':
-        func_label = next(label)
+        func_label = next(scope.context.label)
         scope.add_name(ast[1][1], ast[1], get_function_type(ast, scope), 0, func_label)
         child = scope.new_function()
         child_code = []
@@ -148,14 +218,18 @@ def walk(ast, scope, current_function, current_code_block, code_blocks):
         child_code.append(('#', 'begin of function %s' % ast[1][1]))
         child_code.append(('label', func_label))
 
-        for arg in ast[3][:0:-1]:
+        # the arguments take the first slots of the frame, the call copies them there
+        arg_types = []
+        for arg in ast[3][1:]:
             symb = child.add_name(arg[1][1], arg[1], get_type(arg[2], scope), 1, None)
-            child_code.append(('store_local', arg[1][1], symb.type, symb.varid))
+            arg_types.append(symb.type)
         
         walk(ast[4], child, ast[1][1], child_code, code_blocks)
+        # the frame size is only known once all the locals are declared
+        child_code.insert(2, ('enter', tuple(arg_types), len(child.frame)))
         
-        if child_code[-1][0] != 'ret':
-            error('Function %r does not end in a return statement' % ast[1][1], ast[1])
+        if child_code[-1][0] not in ('ret', 'tail_call'):
+            scope.context.error('Function %r does not end in a return statement' % ast[1][1], ast[1])
         
         child_code.append(('#', 'end of function %s' % ast[1][1]))
         code_blocks.append(child_code)
@@ -167,14 +241,14 @@ def get_type(ast, scope):
     if ast[0] == 'name':
         symbol = scope.resolve(ast[1])
         if symbol is None:
-            error('Type %r is not defined' % ast[1], ast)
+            scope.context.error('Type %r is not defined' % ast[1], ast)
         elif symbol.type != BUILTIN_TYPE_TYPE:
-            error('Expected a type, got %r' % symbol.name, ast)
+            scope.context.error('Expected a type, got %r' % symbol.name, ast)
         else:
             #pprint ((get_type, ast, symbol))
             return symbol.value
     else:
-        error('Expected a type, got %s' % ast[0], None)
+        scope.context.error('Expected a type, got %s' % ast[0], None)
         
 def get_function_type(ast, scope):
     # ast must be a funciton definition
@@ -194,42 +268,42 @@ def walk_expression(ast, scope):
     if ast[0] == 'name':
         symbol = scope.resolve(ast[1])
         if symbol is None:
-            error('Name %r is not defined' % ast[1], ast)
-            symbol = Symbol(ast, None, None, None, None, scope)
+            scope.context.error('Name %r is not defined' % ast[1], ast)
+            symbol = Symbol(ast, None, None, None, None, scope, None)
         if symbol.value is not None:
             return ExpressionType(True, symbol.type, symbol.value, [])
         if symbol.scope.frame == scope.frame:
             op = 'load_local'
         else:
             op = 'load_name'
-        return ExpressionType(False, symbol.type, None, [(op, ast[1], symbol.type, symbol.varid)])
+        return ExpressionType(False, symbol.type, None, [(op, ast[1], symbol.type, symbol.varid, symbol.slot)])
     elif ast[0] == 'num':
         if '.' in ast.lexeme:
             try:
                 val = float(ast.lexeme)
             except ValueError:
-                error('illegal float point literal %r' % ast.lexeme, ast)
+                scope.context.error('illegal float point literal %r' % ast.lexeme, ast)
                 val = 0.0
             return ExpressionType(True, BUILTIN_TYPE_FLOAT, val, const_code(val, BUILTIN_TYPE_FLOAT))
         else:
             try:
                 val = int(ast.lexeme, 10)
             except ValueError:
-                error('illegal integer literal %r' % ast.lexeme, ast)
+                scope.context.error('illegal integer literal %r' % ast.lexeme, ast)
                 val = 0
             return ExpressionType(True, BUILTIN_TYPE_INT, val, const_code(val, BUILTIN_TYPE_INT))
     elif ast[0] in ('+', '-', '*', '/', '%', '=='):
         op1 = walk_expression(ast[2], scope)
         op2 = walk_expression(ast[3], scope)
         if op1.type != op2.type:
-            error('Operands must be of the same types', ast[1])
+            scope.context.error('Operands must be of the same types', ast[1])
 
         if ast[0] == '==':
             ret_type = BUILTIN_TYPE_BOOL
         else:
             ret_type = op1.type    
             if op1.type not in (BUILTIN_TYPE_INT, BUILTIN_TYPE_FLOAT, BUILTIN_TYPE_BYTE):
-                error('Operands must be of type int, byte or float', ast[1])
+                scope.context.error('Operands must be of type int, byte or float', ast[1])
         
         if op1.compile_time and op2.compile_time:
             val = {'+': operator.add,
@@ -251,12 +325,12 @@ def walk_expression(ast, scope):
         op1 = walk_expression(ast[2], scope)
         op2 = walk_expression(ast[3], scope)
         if op1.type != op2.type:
-            error('Can not assign expression of type %r to type %r' % (op1.type, op2.type), ast[1])
+            scope.context.error('Can not assign expression of type %r to type %r' % (op1.type, op2.type), ast[1])
         # must be generalized to lvalues instead of names
         if ast[2][0] == 'name':
             return ExpressionType(False, BUILTIN_TYPE_ASSIGNMENT, None, op1.code + [('load_name', ast[2][1])])
         else:
-            error('Illegal target of assignment', ast[2])
+            scope.context.error('Illegal target of assignment', ast[2])
 
     elif ast[0] == 'func-call':
         func = walk_expression(ast[1], scope)
@@ -264,16 +338,16 @@ def walk_expression(ast, scope):
         ast_args = ast[2][1:]
         arg_types = func.type[2]
         if len(ast_args) != len(arg_types):
-            error('number of arguments mismatch in function call, expected %d but got %d arguments' 
+            scope.context.error('number of arguments mismatch in function call, expected %d but got %d arguments' 
                   % (len(arg_types), len(ast_args)), ast[1])            
         for arg_ast, arg_type in zip(ast_args, arg_types):
             arg = walk_expression(arg_ast, scope)
             if arg.type != arg_type:
-                error('type mismatch in function call, expected %r but got %r'
+                scope.context.error('type mismatch in function call, expected %r but got %r'
                       % (arg_type, arg.type), ast[1])
             code.extend(arg.code)        
         if not func.compile_time:
-            error('can not call expression', ast[1])
+            scope.context.error('can not call expression', ast[1])
         code.append(('call', func.value))
         return ExpressionType(False, func.type[1], None, code)
     else:
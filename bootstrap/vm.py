@@ -1,24 +1,59 @@
+import sys
+import time
+from collections import OrderedDict
 import scopes
 
 LOAD_CONST = 1    #const
-LOAD_LOCAL = 2    #name
+LOAD_LOCAL = 2    #slot
 STORE_LOCAL = 3   #name
-CALL = 4          #ip
+CALL = 4          #function
 RETURN = 5        #type
 EQUALS = 6        #type
 JUMP_IF_FALSE = 7 #ip
 JUMP = 8          #ip
 SUBTRACT = 9     #type
 ADD = 10          #type
+TAIL_CALL = 17    #function
+
+# type specialized opcodes of the unchecked mode, the argument is unused
+ADD_INT = 11
+ADD_FLOAT = 12
+SUBTRACT_INT = 13
+SUBTRACT_FLOAT = 14
+EQUALS_INT = 15
+EQUALS_FLOAT = 16
+
+SPECIALIZED = {('add', scopes.BUILTIN_TYPE_INT): ADD_INT,
+               ('add', scopes.BUILTIN_TYPE_FLOAT): ADD_FLOAT,
+               ('sub', scopes.BUILTIN_TYPE_INT): SUBTRACT_INT,
+               ('sub', scopes.BUILTIN_TYPE_FLOAT): SUBTRACT_FLOAT,
+               ('eq', scopes.BUILTIN_TYPE_INT): EQUALS_INT,
+               ('eq', scopes.BUILTIN_TYPE_FLOAT): EQUALS_FLOAT}
+
+OPCODE_NAMES = {LOAD_CONST: 'LOAD_CONST', LOAD_LOCAL: 'LOAD_LOCAL', STORE_LOCAL: 'STORE_LOCAL',
+                CALL: 'CALL', RETURN: 'RETURN', EQUALS: 'EQUALS', JUMP_IF_FALSE: 'JUMP_IF_FALSE',
+                JUMP: 'JUMP', SUBTRACT: 'SUBTRACT', ADD: 'ADD', TAIL_CALL: 'TAIL_CALL',
+                ADD_INT: 'ADD_INT', ADD_FLOAT: 'ADD_FLOAT', SUBTRACT_INT: 'SUBTRACT_INT',
+                SUBTRACT_FLOAT: 'SUBTRACT_FLOAT', EQUALS_INT: 'EQUALS_INT', EQUALS_FLOAT: 'EQUALS_FLOAT'}
 
 
 
 class Bytecode:
-    def __init__(self, code, start_label):
+    '''assembled code. in checked mode every value on the stack carries its
+    type and the arithmetic opcodes check it at run time. otherwise the
+    types proven by scopes are used to pick type specialized opcodes and
+    the stack holds plain values.'''
+    def __init__(self, code, start_label, checked=False):
         code = [('jump', start_label)] + code
         label_definitions = {}
+        self.checked = checked
+        self.start_label = start_label
 
         self.label_uses = label_uses = []
+        # (arguments, frame size) for the label of every function
+        frames = {}
+        pure = set()
+        calls = []
         self.constants = constants = []
         self.code = bytecode = []
         self.names = names = []
@@ -36,6 +71,11 @@ class Bytecode:
                 pass
             elif instr[0] == 'label':
                 label_definitions[instr[1]] = len(bytecode)
+                last_label = instr[1]
+            elif instr[0] == 'enter':
+                frames[last_label] = (instr[1], instr[2])
+            elif instr[0] == 'pure':
+                pure.add(last_label)
             elif instr[0] == 'load_const':
                 bytecode.append(LOAD_CONST)
                 c = add((instr[2], instr[1]), constants)
@@ -43,24 +83,27 @@ class Bytecode:
                 bytecode.append(c // 256)
             elif instr[0] == 'load_local':
                 bytecode.append(LOAD_LOCAL)
-                c = add((instr[1], instr[2], instr[3]), names)
-                bytecode.append(c % 256)
-                bytecode.append(c // 256)
+                bytecode.append(instr[4] % 256)
+                bytecode.append(instr[4] // 256)
             elif instr[0] == 'store_local':
                 bytecode.append(STORE_LOCAL)
-                c = add((instr[1], instr[2], instr[3]), names)
+                c = add((instr[1], instr[2], instr[4]), names)
+                bytecode.append(c % 256)
+                bytecode.append(c // 256)
+            elif instr[0] in ('call', 'tail_call'):
+                bytecode.append(CALL if instr[0] == 'call' else TAIL_CALL)
+                c = add(instr[1], calls)
                 bytecode.append(c % 256)
                 bytecode.append(c // 256)
-            elif instr[0] == 'call':
-                bytecode.append(CALL)
-                label_uses.append((instr[1], len(bytecode)))
-                bytecode.append(0)
-                bytecode.append(0)
             elif instr[0] == 'ret':
                 bytecode.append(RETURN)
                 c = add(instr[1], types)
                 bytecode.append(c % 256)
                 bytecode.append(c // 256)
+            elif not checked and instr[0] in ('eq', 'sub', 'add') and (instr[0], instr[1]) in SPECIALIZED:
+                bytecode.append(SPECIALIZED[instr[0], instr[1]])
+                bytecode.append(0)
+                bytecode.append(0)
             elif instr[0] == 'eq':
                 bytecode.append(EQUALS)
                 c = add(instr[1], types)
@@ -92,14 +135,99 @@ class Bytecode:
             target = label_definitions[label]
             bytecode[use] = target % 256
             bytecode[use+1] = target // 256    
+        # (ip, argument types, frame size, is pure) of the function of every call
+        self.functions = [(label_definitions[label],) + frames[label] + (label in pure,)
+                          for label in calls]
+        self.start_slots = frames[start_label][1]
+        # label of the function starting at an ip
+        self.entry_labels = dict((label_definitions[label], label) for label in frames)
+
+MISSING = object()
+
+class Profile:
+    '''what VM.execute_profiled measured: count and time of every opcode,
+    calls, inclusive and exclusive time of every function, the time spent in
+    every stack of functions and the maximum depth of the operand and call
+    stacks. names maps the labels of functions to their names.'''
+    def __init__(self, names=None, timer=time.time):
+        self.names = names or {}
+        self.timer = timer
+        self.opcode_counts = {}
+        self.opcode_times = {}
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.stacks = {}
+        self.max_estack = 0
+        self.max_fstack = 0
+
+    def function_name(self, label):
+        return self.names.get(label, 'label%d' % label)
+
+    def report(self, out=sys.stdout):
+        total = sum(self.opcode_times.values()) or 1.0
+        out.write('%-16s %10s %10s %6s\n' % ('opcode', 'count', 'time', '%'))
+        for opcode in sorted(self.opcode_times, key=self.opcode_times.get, reverse=True):
+            out.write('%-16s %10d %10.4f %6.1f\n' % (OPCODE_NAMES[opcode], self.opcode_counts[opcode],
+                                                 self.opcode_times[opcode], 100 * self.opcode_times[opcode] / total))
+        out.write('\n%-16s %10s %10s %10s\n' % ('function', 'calls', 'inclusive', 'exclusive'))
+        for name in sorted(self.exclusive, key=self.exclusive.get, reverse=True):
+            out.write('%-16s %10d %10.4f %10.4f\n' % (name, self.calls.get(name, 0),
+                                                   self.inclusive.get(name, 0.0), self.exclusive[name]))
+        out.write('\nmax operand stack %d, max call stack %d\n' % (self.max_estack, self.max_fstack))
+
+    def write_collapsed(self, out):
+        '''write the stacks in the collapsed format of flamegraph.pl, one
+        line per stack with its time in microseconds'''
+        for stack in sorted(self.stacks):
+            out.write('%s %d\n' % (';'.join(stack), int(self.stacks[stack] * 1e6)))
+
+class Memo:
+    '''bounded cache for the results of pure functions, keyed by the ip of
+    the function and its arguments. when it is full the policy 'lru' evicts
+    the least recently used result, 'fifo' the oldest one.'''
+    def __init__(self, size=10000, policy='lru'):
+        if policy not in ('lru', 'fifo'):
+            raise ValueError('unknown eviction policy %r' % policy)
+        self.size = size
+        self.lru = policy == 'lru'
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.results.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.lru:
+                del self.results[key]
+                self.results[key] = value
+        return value
+
+    def put(self, key, value):
+        self.results[key] = value
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.evictions += 1
 
 class VM:
-    def __init__(self, code, start_label):
-        self.bytecode = Bytecode(code, start_label)
+    def __init__(self, code, start_label=None, checked=False, memo_size=10000, memo_policy='lru'):
+        # code is either a Bytecode or the instructions to make one from,
+        # checked only applies to the latter. the results of pure functions
+        # are cached in the fast mode unless memo_size is 0
+        if isinstance(code, Bytecode):
+            self.bytecode = code
+        else:
+            self.bytecode = Bytecode(code, start_label, checked)
+        self.memo = Memo(memo_size, memo_policy) if memo_size else None
         self.ip = 0 
         self.estack = []
-        self.fstack = [(None, None)]
-        self.frame = {}
+        # (return address, frame, memo key) of the callers
+        self.fstack = [(None, None, None)]
+        self.frame = [None] * self.bytecode.start_slots
         
         
     def pop(self, expected_type):
@@ -110,7 +238,210 @@ class VM:
     def push(self, type, value):
         self.estack.append((type, value))
         
-    def execute(self):
+    def execute(self, profile=None):
+        if profile is not None:
+            self.execute_profiled(profile)
+        elif self.bytecode.checked:
+            self.execute_checked()
+        else:
+            self.execute_fast()
+
+    def execute_fast(self):
+        '''run the code with plain values on the stack, the types were
+        checked when the code was built'''
+        code = self.bytecode.code
+        constants = [value for type, value in self.bytecode.constants]
+        names = self.bytecode.names
+        # the slots after the arguments are filled from a list of Nones.
+        # frames of returned calls are kept in a pool per frame size and
+        # reused by the next call, a tail call reuses the frame of the caller
+        functions = [(target, len(arg_types), [None] * (nb_slots - len(arg_types)), pure)
+                     for target, arg_types, nb_slots, pure in self.bytecode.functions]
+        max_slots = max([len(self.frame)] + [nb_slots for target, arg_types, nb_slots, pure in self.bytecode.functions])
+        memo = self.memo
+        pools = [[] for _ in xrange(max_slots + 1)]
+        stack = self.estack
+        push = stack.append
+        pop = stack.pop
+        fstack = self.fstack
+        frame = self.frame
+        ip = self.ip
+        while ip is not None:
+            instr = code[ip]
+            arg = code[ip+1] + code[ip+2]*256
+            ip += 3
+            if instr == LOAD_LOCAL:
+                push(frame[arg])
+            elif instr == LOAD_CONST:
+                push(constants[arg])
+            elif instr == SUBTRACT_INT or instr == SUBTRACT_FLOAT or instr == SUBTRACT:
+                a = pop()
+                stack[-1] = stack[-1] - a
+            elif instr == ADD_INT or instr == ADD_FLOAT or instr == ADD:
+                a = pop()
+                stack[-1] = stack[-1] + a
+            elif instr == EQUALS_INT or instr == EQUALS_FLOAT or instr == EQUALS:
+                a = pop()
+                stack[-1] = stack[-1] == a
+            elif instr == JUMP_IF_FALSE:
+                if not pop():
+                    ip = arg
+            elif instr == CALL:
+                target, nb_args, empty_slots, pure = functions[arg]
+                key = None
+                if pure and memo is not None:
+                    key = (target, tuple(stack[len(stack)-nb_args:]))
+                    result = memo.get(key)
+                    if result is not MISSING:
+                        del stack[len(stack)-nb_args:]
+                        push(result)
+                        continue
+                fstack.append((ip, frame, key))
+                ip = target
+                pool = pools[nb_args + len(empty_slots)]
+                if pool:
+                    # the old values in the slots of the locals are never read,
+                    # every local is stored before it is used
+                    frame = pool.pop()
+                    if nb_args:
+                        frame[:nb_args] = stack[-nb_args:]
+                        del stack[-nb_args:]
+                elif nb_args:
+                    frame = stack[-nb_args:] + empty_slots
+                    del stack[-nb_args:]
+                else:
+                    frame = empty_slots[:]
+            elif instr == TAIL_CALL:
+                # the result is also the result of the current call, so it
+                # is cached under the key of that call
+                ip, nb_args, empty_slots, pure = functions[arg]
+                if len(frame) != nb_args + len(empty_slots):
+                    frame[nb_args:] = empty_slots
+                if nb_args:
+                    frame[:nb_args] = stack[-nb_args:]
+                    del stack[-nb_args:]
+            elif instr == RETURN:
+                pools[len(frame)].append(frame)
+                ip, frame, key = fstack.pop()
+                if key is not None:
+                    memo.put(key, stack[-1])
+            elif instr == STORE_LOCAL:
+                name, type, slot = names[arg]
+                frame[slot] = pop()
+                print '%s = %s' % (name, frame[slot])
+            elif instr == JUMP:
+                ip = arg
+            else:
+                assert False, 'instruction %r not implemented' % instr
+        self.ip = ip
+        self.frame = frame
+
+    def execute_profiled(self, profile):
+        '''run the code like execute_fast, but without the frame pool and
+        measuring every instruction into profile'''
+        code = self.bytecode.code
+        constants = [value for type, value in self.bytecode.constants]
+        names = self.bytecode.names
+        functions = self.bytecode.functions
+        entry_labels = self.bytecode.entry_labels
+        memo = self.memo
+        stack = self.estack
+        push = stack.append
+        pop = stack.pop
+        fstack = self.fstack
+        frame = self.frame
+        ip = self.ip
+        timer = profile.timer
+        opcode_counts = profile.opcode_counts
+        opcode_times = profile.opcode_times
+        # (name, start time, stack of names) of the functions being executed
+        pstack = []
+        active = {}
+
+        def enter(name, now):
+            path = pstack[-1][2] + (name,) if pstack else (name,)
+            pstack.append((name, now, path))
+            profile.calls[name] = profile.calls.get(name, 0) + 1
+            active[name] = active.get(name, 0) + 1
+
+        def leave(now):
+            name, start, path = pstack.pop()
+            active[name] -= 1
+            # recursive calls are part of the time of the outermost one
+            if not active[name]:
+                profile.inclusive[name] = profile.inclusive.get(name, 0.0) + now - start
+
+        enter(profile.function_name(self.bytecode.start_label), timer())
+        while ip is not None:
+            start = timer()
+            instr = code[ip]
+            arg = code[ip+1] + code[ip+2]*256
+            ip += 3
+            current = pstack[-1]
+            if instr == LOAD_LOCAL:
+                push(frame[arg])
+            elif instr == LOAD_CONST:
+                push(constants[arg])
+            elif instr == SUBTRACT_INT or instr == SUBTRACT_FLOAT or instr == SUBTRACT:
+                a = pop()
+                stack[-1] = stack[-1] - a
+            elif instr == ADD_INT or instr == ADD_FLOAT or instr == ADD:
+                a = pop()
+                stack[-1] = stack[-1] + a
+            elif instr == EQUALS_INT or instr == EQUALS_FLOAT or instr == EQUALS:
+                a = pop()
+                stack[-1] = stack[-1] == a
+            elif instr == JUMP_IF_FALSE:
+                if not pop():
+                    ip = arg
+            elif instr == CALL or instr == TAIL_CALL:
+                target, arg_types, nb_slots, pure = functions[arg]
+                nb_args = len(arg_types)
+                key = None
+                if instr == CALL and pure and memo is not None:
+                    key = (target, tuple(stack[len(stack)-nb_args:]))
+                    result = memo.get(key)
+                    if result is not MISSING:
+                        del stack[len(stack)-nb_args:]
+                        push(result)
+                        key = MISSING
+                if key is not MISSING:
+                    if instr == CALL:
+                        fstack.append((ip, frame, key))
+                    else:
+                        leave(timer())
+                    ip = target
+                    frame = stack[len(stack)-nb_args:] + [None] * (nb_slots - nb_args)
+                    del stack[len(stack)-nb_args:]
+                    enter(profile.function_name(entry_labels[target]), timer())
+            elif instr == RETURN:
+                ip, frame, key = fstack.pop()
+                if key is not None:
+                    memo.put(key, stack[-1])
+                leave(timer())
+            elif instr == STORE_LOCAL:
+                name, type, slot = names[arg]
+                frame[slot] = pop()
+                print '%s = %s' % (name, frame[slot])
+            elif instr == JUMP:
+                ip = arg
+            else:
+                assert False, 'instruction %r not implemented' % instr
+            elapsed = timer() - start
+            opcode_counts[instr] = opcode_counts.get(instr, 0) + 1
+            opcode_times[instr] = opcode_times.get(instr, 0.0) + elapsed
+            name, _, path = current
+            profile.exclusive[name] = profile.exclusive.get(name, 0.0) + elapsed
+            profile.stacks[path] = profile.stacks.get(path, 0.0) + elapsed
+            if len(stack) > profile.max_estack:
+                profile.max_estack = len(stack)
+            if len(fstack) > profile.max_fstack:
+                profile.max_fstack = len(fstack)
+        self.ip = ip
+        self.frame = frame
+
+    def execute_checked(self):
+        # the frame keeps the values with their types
         while self.ip is not None:
             instr = self.bytecode.code[self.ip]
             arg = self.bytecode.code[self.ip+1] + self.bytecode.code[self.ip+2]*256
@@ -120,21 +451,29 @@ class VM:
                 type, value = self.bytecode.constants[arg]
                 self.push(type, value)
             elif instr == LOAD_LOCAL:
-                name, type, varid = self.bytecode.names[arg]
-                self.push(type, self.frame[varid])
+                self.estack.append(self.frame[arg])
             elif instr == STORE_LOCAL:
-                name, type, varid = self.bytecode.names[arg]
-                self.frame[varid] = self.pop(type)
-                print '%s = %s' % (name, self.frame[varid])
+                name, type, slot = self.bytecode.names[arg]
+                self.frame[slot] = (type, self.pop(type))
+                print '%s = %s' % (name, self.frame[slot][1])
             elif instr == CALL:
                 #print 'before calling', self.fstack, self.ip
-                self.fstack.append((self.ip, self.frame))
-                self.frame = {}
-                self.ip = arg
+                self.fstack.append((self.ip, self.frame, None))
+                self.ip, arg_types, nb_slots, pure = self.bytecode.functions[arg]
+                self.frame = [None] * nb_slots
+                for slot in reversed(xrange(len(arg_types))):
+                    self.frame[slot] = (arg_types[slot], self.pop(arg_types[slot]))
+            elif instr == TAIL_CALL:
+                # like CALL, but returning to the caller of the current function
+                self.ip, arg_types, nb_slots, pure = self.bytecode.functions[arg]
+                frame = [None] * nb_slots
+                for slot in reversed(xrange(len(arg_types))):
+                    frame[slot] = (arg_types[slot], self.pop(arg_types[slot]))
+                self.frame = frame
                 #print 'after calling', self.fstack, self.ip
             elif instr == RETURN:
                 #print 'before returning', self.fstack, self.ip
-                self.ip, self.frame = self.fstack.pop()
+                self.ip, self.frame, key = self.fstack.pop()
                 #print 'after returning', self.fstack, self.ip
             elif instr == EQUALS:
                 type = self.bytecode.types[arg]